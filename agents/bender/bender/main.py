@@ -1,16 +1,16 @@
 import os
 import sys
 import argparse
-import shutil
 import logging
 from agent import Agent
 from toolkits import FileToolkit, GitToolkit, SystemToolkit, MelangeToolkit, WebToolkit
+from toolkits.tokens import ledger
+from toolkits.system import build_cache
+from toolkits import resources
+from toolkits.melange import close_session
 from utils import load_openai_api_key
 
 
-# A tmp file to hold YAML result. This will be copied to the user specified location.
-TMP_YAML_PATH = "tmp.yaml"
-
 # API Key
 os.environ["OPENAI_API_KEY"] = load_openai_api_key()
 
@@ -43,14 +43,15 @@ You are given a detailed description of how to build a GitHub project from sourc
 tasked with constructing a Melange YAML file that packages the project for Wolfi, a minimal
 linux distribution designed for containerized applications. You will not be asked to produce
 any YAML. Instead you will define the components of the YAML via the functions provided.
-The YAML model you must define can be initialized using melange_add_header.
 Every YAML model must have a header. In addition, every model must have a pipeline.
 The pipeline contains the steps for building the project. For example, if the build
-process requires building a go module, you could call melange_add_pipeline_go_build.
+process requires building a go module, you could use a go/build step.
 Pipeline steps will occur in the order you define them. Pay attention to ordering to
 ensure build commands execute in the correct order. You should minimize the amount of
 pipeline steps. You can repeat pipeline steps or use zero instances of a step.
-Don't forget to write the model out at the very end using melange_write_model.
+Define the whole model at once with melange_apply_spec, which also writes it out. If it
+returns errors, fix all of them and call it again. Use the other melange functions only
+for small changes afterwards and then write the model out using melange_write_model.
 """
 
 
@@ -74,6 +75,10 @@ def main():
     build instruction generation and melange YAML creation. 
     """
     args = parse_args()
+    build_cache.usage.begin()
+    # Per-command resource usage is written next to the output
+    stem = os.path.splitext(args.output)[0]
+    resources.ledger.open(f"/output/{stem}.resources.jsonl")
 
     # Stage 1: Build Instructions
     build_toolkits = [GitToolkit(),
@@ -88,16 +93,20 @@ def main():
     logging.info(f"BUILD INSTRUCTIONS:\n{desc}")
 
     # Stage 2: Melange YAML generation
-    package_tools = MelangeToolkit().get_tools()
+    melange_toolkit = MelangeToolkit(output_path=f"/output/{args.output}")
+    package_tools = melange_toolkit.get_tools()
     build_agent = Agent(PACKAGE_PROMPT, ["package", "version", "build_desc"], package_tools)
     build_agent.run({"package": args.package,
                      "version": args.version,
                      "build_desc": desc},
                      verbose=False)
-    
-    # Copy YAML file result to the user specified location
-    shutil.copyfile(TMP_YAML_PATH, f"/output/{args.output}")
-    os.remove(TMP_YAML_PATH)
+    close_session(melange_toolkit.session_id)
+
+    logging.info(ledger.summary())
+    logging.info(build_cache.usage.report())
+    freed = build_cache.prune()
+    if freed > 0:
+        logging.info(f"Pruned {freed} bytes from the build cache")
 
 
 if __name__ == "__main__":
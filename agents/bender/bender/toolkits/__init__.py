@@ -1,51 +1,73 @@
-from typing import List
+from typing import List, Optional
 from langchain.agents.agent_toolkits.base import BaseToolkit
 from langchain.tools import BaseTool, StructuredTool
 
 
 from .file import (file_read_from_path,
+                   file_read_page,
                    file_write_to_path,
-                   file_refine_and_read)
+                   file_refine_and_read,
+                   file_refine_and_read_many,
+                   file_search_repo)
 
 class FileToolkit(BaseToolkit):
     def get_tools(self) -> List[BaseTool]:
         return [
             StructuredTool.from_function(f) for f in (
                 file_read_from_path,
+                file_read_page,
                 file_write_to_path,
-                file_refine_and_read)]
+                file_refine_and_read,
+                file_refine_and_read_many,
+                file_search_repo)]
 
 
-from .system import system_run_sh, system_list_dir
+from .system import (system_run_sh,
+                     system_shell,
+                     system_shell_restart,
+                     system_list_dir,
+                     system_tree,
+                     system_checkpoint,
+                     system_rollback)
 
 class SystemToolkit(BaseToolkit):
     def get_tools(self) -> List[BaseTool]:
         return [
             StructuredTool.from_function(f) for f in (
                 system_run_sh,
-                system_list_dir)]
+                system_shell,
+                system_shell_restart,
+                system_list_dir,
+                system_tree,
+                system_checkpoint,
+                system_rollback)]
     
 
-from .git import git_list_branches_and_tags, git_clone
+from .git import git_list_branches_and_tags, git_resolve_version, git_clone
 
 class GitToolkit(BaseToolkit):
     def get_tools(self) -> List[BaseTool]:
         return [
             StructuredTool.from_function(f) for f in (
                 git_list_branches_and_tags,
+                git_resolve_version,
                 git_clone)]
 
 
-from .web import web_websearch
+from .web import web_websearch, web_fetch
 
 class WebToolkit(BaseToolkit):
     def get_tools(self) -> List[BaseTool]:
         return [
             StructuredTool.from_function(f) for f in (
-                web_websearch,)]
+                web_websearch,
+                web_fetch)]
 
 
-from .melange import (melange_add_header,
+from .melange import (bind_session,
+                      open_session,
+                      apply_spec_tool,
+                      melange_add_header,
                       melange_add_build_dependency,
                       melange_add_pipeline_runs,
                       melange_add_pipeline_git_checkout,
@@ -53,9 +75,20 @@ from .melange import (melange_add_header,
                       melange_write_model)
 
 class MelangeToolkit(BaseToolkit):
+    """
+    Melange tools bound to one model. Toolkits with different session
+    ids build separate models and can be used concurrently.
+    output_path: Where melange_write_model writes the YAML
+    session_id: The model to bind to. Defaults to a new one.
+    """
+    output_path: str
+    session_id: Optional[str] = None
+
     def get_tools(self) -> List[BaseTool]:
-        return [
-            StructuredTool.from_function(f) for f in (
+        session = open_session(self.output_path, self.session_id)
+        self.session_id = session.session_id
+        return [apply_spec_tool(session)] + [
+            StructuredTool.from_function(bind_session(f, session)) for f in (
                 melange_add_header,
                 melange_add_build_dependency,
                 melange_add_pipeline_runs,
@@ -0,0 +1,132 @@
+"""
+A small disk-backed key-value cache shared by the toolkits.
+Entries are stored in SQLite and evicted in least recently used
+order once the cache grows past its size limit.
+"""
+
+from typing import Dict, Optional
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+CACHE_DIR_ENV = "BENDER_CACHE_DIR"
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bender")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+SQLITE_TIMEOUT = 30
+
+
+def cache_dir(*parts: str) -> str:
+    """
+    Returns (and creates) a directory under the cache root.
+    The root can be overridden with the BENDER_CACHE_DIR env var.
+    """
+    root = os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)
+    path = os.path.join(root, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def content_hash(content: str) -> str:
+    """
+    The sha256 hex digest of a string
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def make_key(*parts: str) -> str:
+    """
+    Builds a cache key from several parts. Parts are separated by
+    a null byte so that ("ab", "c") and ("a", "bc") do not collide.
+    """
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(str(p).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class DiskCache:
+    """
+    A size-bounded LRU cache of strings persisted to a SQLite file
+    """
+    def __init__(self, path: str, max_bytes: int=DEFAULT_MAX_BYTES):
+        """
+        @param path: The SQLite database file backing the cache
+        @param max_bytes: The total size of stored values before eviction
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=SQLITE_TIMEOUT,
+                                     check_same_thread=False)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS entries ("
+                               "key TEXT PRIMARY KEY, "
+                               "value TEXT NOT NULL, "
+                               "size INTEGER NOT NULL, "
+                               "created REAL NOT NULL, "
+                               "accessed REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed "
+                               "ON entries (accessed)")
+
+    def get(self, key: str, ttl: float=None) -> Optional[str]:
+        """
+        Returns the value stored under key or None on a miss.
+        @param ttl: If set, entries older than ttl seconds are misses
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value, created FROM entries WHERE key = ?",
+                                     (key,)).fetchone()
+            if row is None or (ttl is not None and time.time() - row[1] > ttl):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?",
+                               (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str):
+        """
+        Stores a value and evicts least recently used entries
+        if the cache is over its size limit
+        """
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO entries "
+                               "(key, value, size, created, accessed) "
+                               "VALUES (?, ?, ?, ?, ?)",
+                               (key, value, size, now, now))
+            self._evict()
+
+    def _evict(self):
+        """
+        Deletes the oldest accessed entries until the cache fits in max_bytes
+        """
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries") \
+                          .fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM entries ORDER BY accessed")
+        stale = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", stale)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Hit/miss counters and the current size of the cache
+        """
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": entries, "bytes": size}
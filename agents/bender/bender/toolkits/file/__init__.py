@@ -2,12 +2,14 @@
 A collection of file operation tools.
 """
 
+from typing import List
 import logging
-from .basic import read_from_path, write_to_path
-from .refine import refine_and_read
+from .basic import read_from_path, read_page, write_to_path
+from .refine import refine_and_read, refine_and_read_many
 from .store_lookup import vstore_and_read
-from .exceptions import FileTooBigError, UnsupportedLanguage
-from .utils import count_tokens
+from .search import search_repo
+from .exceptions import FileTooBigError, PageOutOfRange, UnsupportedLanguage
+from ..tokens import approx_tokens, ledger
 
 
 MODEL_NAME = "gpt-4"
@@ -23,22 +25,26 @@ def _snapshot(text: str) -> str:
     return text[:MAX_DISPLAY_LEN] + "..."
 
 
-def _log_read(text: str):
+def _log_read(text: str, tool: str):
     """
-    Logs a read operation
+    Logs a read operation and records the (approximate) tokens
+    returned to the agent
     """
-    ntok = count_tokens(text, MODEL_NAME)
+    ntok = approx_tokens(text)
+    ledger.record(tool, MODEL_NAME, ntok)
     summary = _snapshot(text)
-    logging.info(f"Read {ntok} tokens: \"{summary}\"")
+    logging.info(f"Read ~{ntok} tokens: \"{summary}\"")
 
 
-def _log_write(text: str):
+def _log_write(text: str, tool: str):
     """
-    Logs a write operation
+    Logs a write operation and records the (approximate) tokens
+    written by the agent
     """
-    ntok = count_tokens(text)
+    ntok = approx_tokens(text)
+    ledger.record(tool, MODEL_NAME, ntok)
     summary = _snapshot(text)
-    logging.info(f"Wrote {ntok} tokens: \"{summary}\"")
+    logging.info(f"Wrote ~{ntok} tokens: \"{summary}\"")
 
 
 def file_read_from_path(path: str) -> str:
@@ -55,62 +61,135 @@ def file_read_from_path(path: str) -> str:
         return "Error: File not found"
     except FileTooBigError:
         logging.error(f"File is too big to read at once.")
-        return "Error: File size exceeds max number of tokens"
-    _log_read(text)
+        return "Error: File size exceeds max number of tokens. " \
+               "Use file_read_page to read it one page at a time."
+    _log_read(text, "file_read_from_path")
     return text
 
 
+def file_read_page(path: str, page: int=1) -> str:
+    """
+    Returns one page of the raw contents of a file at the specified path.
+    Pages hold about 2000 tokens, end on line boundaries and are numbered
+    from 1. The response starts with the page number, the total number of
+    pages and the line numbers covered by the page. Useful for reading
+    files that are too big to read at once. If the file does not exist
+    or the page is out of range, an error is returned.
+    """
+    logging.info(f"Reading page {page} of {path}...")
+    try:
+        text, npages, first, last = read_page(path, page)
+    except FileNotFoundError:
+        logging.error(f"File not found. {path} does not exist.")
+        return "Error: File not found"
+    except PageOutOfRange:
+        logging.error(f"Page {page} is out of range.")
+        return f"Error: Page {page} is out of range"
+    _log_read(text, "file_read_page")
+    return f"[page {page} of {npages}, lines {first}-{last}]\n{text}"
+
+
 def file_write_to_path(path: str, content: str) -> str:
     """
     Writes the provided content to the provided path.
     You are not allowed to overwrite preexisting files.
     If the file already exists, an error is returned.
     """
-    logging.log(f"Writing content to {path}...")
+    logging.info(f"Writing content to {path}...")
     try:
         write_to_path(path, content)
     except FileExistsError:
         logging.error("File already exists. Cannot overwrite")
         return "Error: File already exists"
-    _log_write(content)
+    _log_write(content, "file_write_to_path")
     return "Success"
 
 
 def file_refine_and_read(path: str, query: str,
-                         language: str=None) -> str:
+                         language: str=None, progressive: bool=False) -> str:
     """
     Condenses a large text document at the provided path down to
     a smaller summary based on the provided query. Useful for analyzing
     larger documents. Option to refine based on the language used in the
     document. The supported languages are: text, cpp, go, java, kotlin, js, ts,
     php, proto, python, rst, ruby, rust, scala, swift, markdown, latex,
-    html, sol, and csharp. Queries should be detailed to ensure the summary contains all
-    of the desired info. If the path does not exist, an error is returned.
+    html, sol, and csharp. If no language is provided it is inferred from the file.
+    Queries should be detailed to ensure the summary contains all
+    of the desired info. Set progressive to True when the answer is likely
+    found in a small part of the document. Progressive mode reads the most
+    relevant chunks first and stops once the query is answered.
+    If the path does not exist, an error is returned.
     """
     logging.info(f"Refining {path} according to \"{query}\"...")
     try:
-        text = refine_and_read(path, query, language=language)
+        text = refine_and_read(path, query, language=language,
+                               progressive=progressive)
     except FileNotFoundError:
         logging.error(f"File not found. {path} does not exist.")
         return "Error: File not found"
-    _log_read(text)
+    _log_read(text, "file_refine_and_read")
+    return text
+
+
+def file_refine_and_read_many(paths: List[str], query: str,
+                              progressive: bool=False) -> str:
+    """
+    Like file_refine_and_read but condenses several documents into one
+    summary based on the provided query. Useful when the desired info is
+    spread across several files such as a README, a Makefile and build
+    scripts. Content repeated across the documents is only read once.
+    If any path does not exist, an error is returned.
+    """
+    logging.info(f"Refining {', '.join(paths)} according to \"{query}\"...")
+    try:
+        text = refine_and_read_many(paths, query, progressive=progressive)
+    except FileNotFoundError:
+        logging.error(f"File not found. One of {paths} does not exist.")
+        return "Error: File not found"
+    _log_read(text, "file_refine_and_read_many")
+    return text
+
+
+def file_search_repo(path: str, query: str) -> str:
+    """
+    Full-text search over the files of a cloned repository. Returns the
+    best matching snippets as path:line followed by the matching lines.
+    path is the top level directory of the repository. Queries are
+    keywords such as "go build ldflags" or "cmake minimum version".
+    Use this to find where build information lives instead of listing
+    directories and reading files one at a time. If the path does not
+    exist, an error is returned.
+    """
+    logging.info(f"Searching {path} for \"{query}\"...")
+    try:
+        snippets = search_repo(path, query)
+    except FileNotFoundError:
+        logging.error(f"Path not found. {path} does not exist.")
+        return "Error: Path not found"
+    if len(snippets) == 0:
+        return "No matches found"
+    text = "\n".join(snippets)
+    _log_read(text, "file_search_repo")
     return text
 
 
-def file_vstore_and_read(path: str, query: str, language: str=None) -> str:
+def file_vstore_and_read(path: str, query: str, language: str=None,
+                         k: int=1) -> str:
     # TODO: Shorten description
     # NOTE: This tool is not provided to Bender
     """
     Splits the contents of a text-based file located at the provided
     path into chunks that are stored in a vectorstore.
     After splitting, a query is applied to the store and
-    the top matching chunk is returned. Queries should be
+    the top k matching chunks are returned with their distance
+    to the query. Queries should be
     carefully crafted to extract the desired information.
     Option to specify the language of the file to improve splitting.
     The supported languages are: text, cpp, go, java, kotlin, js, ts,
     php, proto, python, rst, ruby, rust, scala, swift, markdown, latex,
-    html, sol, and csharp. Useful for extracting important information from a large
-    from larger files. Because only one document chunk is
+    html, sol, and csharp. If no language is provided it is inferred from the
+    file. Useful for extracting important information from a large
+    from larger files. Because only a few document chunks are
     returned you should only use this if you believe the desired
     information is condensed in the file and not dispersed throughout.
     An error is returned if the path is invalid. Note: This function
@@ -118,12 +197,12 @@ def file_vstore_and_read(path: str, query: str, language: str=None) -> str:
     """
     logging.info("Building vector store from {path} according to \"{query}\"...")
     try:
-        text = vstore_and_read(path, query, language=language)
+        text = vstore_and_read(path, query, language=language, k=k)
     except FileNotFoundError:
         logging.error(f"File not found. {path} does not exist.")
         return "Error: File not found"
     except UnsupportedLanguage:
         logging.error(f"Received an invalid language {language}")
         return f"Error: {language} is not a supported language"
-    _log_read(text)
+    _log_read(text, "file_vstore_and_read")
     return text
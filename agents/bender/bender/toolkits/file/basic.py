@@ -2,24 +2,122 @@
 Tools for basic read and write operations
 """
 
+from typing import List, Tuple
 import os
-from .exceptions import FileTooBigError
-from .utils import count_tokens
+import mmap
+import functools
+from .exceptions import FileTooBigError, PageOutOfRange
+from ..tokens import count_tokens, count_tokens_batch
 
 
 MAX_READ_TOKENS = 3000
 MODEL_NAME = "gpt-4"
 
+# Files larger than this many bytes per allowed token are rejected without
+# reading them. Source code averages about 4 bytes per token.
+MAX_BYTES_PER_TOKEN = 16
+
+PAGE_TOKENS = 2000
+LONG_LINE_BYTES = PAGE_TOKENS * 3 # Lines longer than this are split across pages
+PAGE_INDEX_CACHE_SIZE = 64
+COUNT_BATCH_SIZE = 1024 # Lines tokenized per encode_batch call
+
 
 def read_from_path(path: str) -> str:
     """
     Read an entire file.
     """
+    size = os.path.getsize(path)
+    if size > MAX_READ_TOKENS * MAX_BYTES_PER_TOKEN:
+        raise FileTooBigError()
     with open(path, "r", encoding="utf-8") as f: # TODO: Dangerous. Susceptible to path traversal
-        text = f.read()
-        if count_tokens(text, MODEL_NAME) > MAX_READ_TOKENS:
-            raise FileTooBigError()
-        return text
+        # Every token is at least one byte so small files always fit
+        if size <= MAX_READ_TOKENS:
+            return f.read()
+        lines = []
+        ntokens = 0
+        for line in f:
+            ntokens += count_tokens(line, MODEL_NAME)
+            if ntokens > MAX_READ_TOKENS:
+                raise FileTooBigError()
+            lines.append(line)
+        return "".join(lines)
+
+
+def _line_spans(m: mmap.mmap) -> List[Tuple[int, int, int]]:
+    """
+    The (start, end, line number) byte spans of the lines of a file.
+    Long lines are split into several spans on utf-8 character boundaries.
+    """
+    spans = []
+    pos = 0
+    lineno = 1
+    while pos < len(m):
+        nl = m.find(b"\n", pos)
+        end = len(m) if nl == -1 else nl + 1
+        while end - pos > LONG_LINE_BYTES:
+            cut = pos + LONG_LINE_BYTES
+            # A utf-8 character has at most 3 continuation bytes. Malformed
+            # or binary input may have more, so it is then cut hard.
+            while cut > pos + LONG_LINE_BYTES - 4 and (m[cut] & 0xC0) == 0x80:
+                cut -= 1
+            if (m[cut] & 0xC0) == 0x80:
+                cut = pos + LONG_LINE_BYTES
+            spans.append((pos, cut, lineno))
+            pos = cut
+        spans.append((pos, end, lineno))
+        pos = end
+        lineno += 1
+    return spans
+
+
+@functools.lru_cache(maxsize=PAGE_INDEX_CACHE_SIZE)
+def _page_index(path: str, size: int, mtime: int) -> List[Tuple[int, int, int, int]]:
+    """
+    Splits a file into pages of about PAGE_TOKENS tokens on line boundaries.
+    Cached per file version through size and mtime.
+    @return: (start byte, end byte, first line, last line) of each page
+    """
+    if size == 0:
+        return [(0, 0, 1, 1)]
+    pages = []
+    with open(path, "rb") as f, \
+         mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        spans = _line_spans(m)
+        sizes = []
+        for i in range(0, len(spans), COUNT_BATCH_SIZE):
+            batch = [m[begin:end].decode("utf-8", errors="replace")
+                     for begin, end, _ in spans[i:i + COUNT_BATCH_SIZE]]
+            sizes.extend(count_tokens_batch(batch, MODEL_NAME))
+        start = None
+        ntokens = 0
+        for (begin, end, lineno), n in zip(spans, sizes):
+            if start is not None and ntokens + n > PAGE_TOKENS:
+                pages.append((start, begin, first, last))
+                start = None
+            if start is None:
+                start, first, ntokens = begin, lineno, 0
+            ntokens += n
+            last = lineno
+        pages.append((start, len(m), first, last))
+    return pages
+
+
+def read_page(path: str, page: int) -> Tuple[str, int, int, int]:
+    """
+    Reads one page of a file. Pages are numbered from 1.
+    @return: The text of the page, the number of pages, and the
+             first and last line of the page
+    """
+    st = os.stat(path)
+    pages = _page_index(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if page < 1 or page > len(pages):
+        raise PageOutOfRange()
+    start, end, first, last = pages[page - 1]
+    with open(path, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode("utf-8", errors="replace")
+    return text, len(pages), first, last
 
 
 def write_to_path(path: str, content: str):
@@ -0,0 +1,128 @@
+"""
+Exact and near-duplicate detection of document chunks. Near duplicates
+are found with MinHash signatures over word shingles and LSH banding.
+"""
+
+from typing import Iterable, Iterator, List, Optional
+import re
+import zlib
+import hashlib
+import numpy as np
+from langchain.schema.document import Document
+
+
+SHINGLE_SIZE = 5 # Words per shingle
+NUM_PERM = 64
+NUM_BANDS = 16 # NUM_PERM must be divisible by NUM_BANDS
+SIMILARITY_THRESHOLD = 0.85
+SEED = 1
+_PRIME = (1 << 31) - 1
+
+
+def _normalize(text: str) -> str:
+    """
+    Collapses whitespace so formatting changes do not hide duplicates
+    """
+    return " ".join(text.split())
+
+
+def _shingles(text: str) -> np.ndarray:
+    """
+    The crc32 hashes of the word shingles of a text
+    """
+    words = re.findall(r"\S+", text.lower())
+    if len(words) <= SHINGLE_SIZE:
+        windows = [" ".join(words)]
+    else:
+        windows = [" ".join(words[i:i + SHINGLE_SIZE])
+                   for i in range(len(words) - SHINGLE_SIZE + 1)]
+    hashes = {zlib.crc32(w.encode("utf-8")) for w in windows}
+    return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+
+class ChunkDeduplicator:
+    """
+    Detects chunks that are exact or near duplicates of chunks seen before.
+    Share one instance across files to deduplicate a whole job.
+    """
+    def __init__(self, threshold: float=SIMILARITY_THRESHOLD):
+        """
+        @param threshold: Estimated Jaccard similarity above which two
+                          chunks are considered duplicates
+        """
+        self.threshold = threshold
+        self.nseen = 0
+        self.nexact = 0
+        self.nnear = 0
+        rng = np.random.RandomState(SEED)
+        self._a = rng.randint(1, _PRIME, size=NUM_PERM).astype(np.uint64)
+        self._b = rng.randint(0, _PRIME, size=NUM_PERM).astype(np.uint64)
+        self._exact = set()
+        self._signatures = []
+        self._buckets = {}
+
+    def _signature(self, text: str) -> np.ndarray:
+        """
+        The MinHash signature of a text
+        """
+        x = _shingles(text)[:, None]
+        return ((self._a * x + self._b) % _PRIME).min(axis=0)
+
+    def _bands(self, signature: np.ndarray) -> List[bytes]:
+        """
+        The LSH bucket keys of a signature
+        """
+        rows = NUM_PERM // NUM_BANDS
+        return [bytes([i]) + signature[i * rows:(i + 1) * rows].tobytes()
+                for i in range(NUM_BANDS)]
+
+    def _near_match(self, signature: np.ndarray, bands: List[bytes]) -> Optional[int]:
+        """
+        The index of a previously seen chunk similar to the signature
+        """
+        candidates = set()
+        for band in bands:
+            candidates.update(self._buckets.get(band, []))
+        for i in sorted(candidates):
+            if np.mean(self._signatures[i] == signature) >= self.threshold:
+                return i
+        return None
+
+    def is_duplicate(self, text: str) -> bool:
+        """
+        Checks if a text duplicates one seen before. Texts that are
+        not duplicates are remembered.
+        """
+        self.nseen += 1
+        digest = hashlib.sha256(_normalize(text).encode("utf-8")).digest()
+        if digest in self._exact:
+            self.nexact += 1
+            return True
+
+        signature = self._signature(text)
+        bands = self._bands(signature)
+        if self._near_match(signature, bands) is not None:
+            self.nnear += 1
+            return True
+
+        self._exact.add(digest)
+        index = len(self._signatures)
+        self._signatures.append(signature)
+        for band in bands:
+            self._buckets.setdefault(band, []).append(index)
+        return False
+
+    def filter(self, docs: Iterable[Document]) -> Iterator[Document]:
+        """
+        Lazily yields only the documents that are not duplicates
+        """
+        for d in docs:
+            if not self.is_duplicate(d.page_content):
+                yield d
+
+    @property
+    def nduplicates(self) -> int:
+        """
+        The number of exact and near duplicates found so far
+        """
+        return self.nexact + self.nnear
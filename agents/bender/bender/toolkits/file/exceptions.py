@@ -8,4 +8,10 @@ class UnsupportedLanguage(Exception):
     """
     Raised if a language type is not supported for a file split operation
     """
-    pass
\ No newline at end of file
+    pass
+
+class PageOutOfRange(Exception):
+    """
+    Raised if a paged read asks for a page past the end of a file
+    """
+    pass
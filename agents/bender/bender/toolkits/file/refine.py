@@ -3,24 +3,53 @@ File refinement tools for reading large files that are too big for
 the context window.
 """
 
-from typing import List
+from typing import Iterable, List, Tuple
+import itertools
 import os
+import re
+import math
 import asyncio
+import logging
+import functools
 from langchain.prompts import PromptTemplate
 from langchain.schema.document import Document
 from langchain.chat_models import ChatOpenAI
 from langchain.schema.output_parser import StrOutputParser
 from tqdm.asyncio import tqdm
-from yaspin import yaspin
-from yaspin.spinners import Spinners
-from .utils import check_language, split_file
+from ..cache import DiskCache, cache_dir, content_hash, make_key
+from .dedup import ChunkDeduplicator
+from .scheduler import RateLimiter
+from ..tokens import count_tokens, count_tokens_batch, ledger
+from .utils import check_language, iter_split_file
 
 
-CHUNK_SIZE = 4000
-CHUNK_OVERLAP = 250
+CHUNK_TOKENS = 4000
+CHUNK_OVERLAP_TOKENS = 100
 MODEL_REFINE = "gpt-3.5-turbo-1106" # Use gpt-3 for refine step to reduce costs
 MODEL_AGG = "gpt-4"
 MODEL_TEMP = 0
+LEDGER_TOOL = "file_refine_and_read" # Token usage is recorded under this name
+PROMPT_VERSION = "1" # Bump when CHUNK_REFINE_PROMPT or CHUNK_AGG_PROMPT change
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Budgets for the refine model. Keep these at or below the account limits.
+REFINE_RPM = 3500
+REFINE_TPM = 60000
+REFINE_MAX_CONCURRENCY = 8
+REFINE_MAX_OUTPUT_TOKENS = 512 # Expected size of a chunk summary
+
+# Aggregation is a tree reduction over groups of summaries
+AGG_GROUP_TOKENS = 5000 # Leaves room in the gpt-4 context for the prompt and answer
+AGG_MAX_LEVELS = 6
+AGG_RPM = 500
+AGG_TPM = 40000
+AGG_MAX_CONCURRENCY = 4
+AGG_MAX_OUTPUT_TOKENS = 1024
+MIN_SUMMARY_CHARS = 16 # Shorter summaries are treated as empty
+NO_INFO_RESPONSE = "No information relevant to the query was found."
+
+# Progressive mode refines the most relevant chunks first, in waves
+WAVE_SIZE = 4
 
 
 CHUNK_REFINE_PROMPT = """
@@ -69,23 +98,89 @@ Aggregate summary:
                           
 """
 
+COMPLETENESS_PROMPT = """
+Below are notes taken while reading parts of a document
+in an attempt to answer the provided query. Decide whether
+the notes already contain a complete answer to the query.
+Respond with only YES or NO.
+
+<query>
+{query}
+</query>
+
+<notes>
+{notes}
+</notes>
+
+Complete:
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def _summary_cache() -> DiskCache:
+    """
+    The on-disk cache of chunk and aggregate summaries
+    """
+    path = os.path.join(cache_dir("refine"), "summaries.db")
+    return DiskCache(path, max_bytes=CACHE_MAX_BYTES)
+
+
+def _chunk_key(doc: Document, query: str) -> str:
+    """
+    Cache key of a chunk summary
+    """
+    return make_key("chunk", content_hash(doc.page_content), query,
+                    MODEL_REFINE, PROMPT_VERSION)
+
 
-async def _ainvoke_chain(chain, input, delay) -> str:
+def _agg_key(summaries: List[str], query: str) -> str:
     """
-    Async call a chain
+    Cache key of an aggregate summary
     """
-    await asyncio.sleep(delay)
-    response = await chain.ainvoke(input)
-    return response
+    return make_key("agg", content_hash("\n\n".join(summaries)), query,
+                    MODEL_AGG, PROMPT_VERSION)
 
 
-async def _refine_chunks(docs: List[Document], query: str) -> List[str]:
+def _refine_cost(doc: Document, query: str) -> int:
     """
-    Refine step
+    Estimated number of tokens used by refining a chunk
+    """
+    text = CHUNK_REFINE_PROMPT + query + doc.page_content
+    return count_tokens(text, MODEL_REFINE) + REFINE_MAX_OUTPUT_TOKENS
+
+
+async def _refine_chunk(chain, limiter: RateLimiter, doc: Document,
+                        query: str) -> str:
+    """
+    Refines one chunk, serving it from the cache when possible
+    """
+    cache = _summary_cache()
+    key = _chunk_key(doc, query)
+    summary = cache.get(key)
+    if summary is None:
+        input_ = {"query": query, "doc": doc}
+        cost = _refine_cost(doc, query)
+        summary = await limiter.run(lambda: chain.ainvoke(input_), cost)
+        ledger.record(LEDGER_TOOL, MODEL_REFINE, cost)
+        cache.put(key, summary)
+    return summary
+
+
+async def _refine_chunks(docs: Iterable[Document], query: str,
+                         llm: any=None, limiter: RateLimiter=None) -> List[str]:
+    """
+    Refine step. Chunks are consumed lazily so requests for the first
+    chunks are sent while the rest of the file is still being split.
+    @param llm: Overrides the refine model. Useful for testing.
+    @param limiter: Shares the refine budget with other calls of the job.
+    Defaults to a new limiter.
     """
     prompt = PromptTemplate.from_template(CHUNK_REFINE_PROMPT)
-    llm = ChatOpenAI(temperature=MODEL_TEMP,
-                     model=MODEL_REFINE)
+    if llm is None:
+        # Retries are left to the scheduler so it can see 429s
+        llm = ChatOpenAI(temperature=MODEL_TEMP,
+                         model=MODEL_REFINE,
+                         max_retries=0)
     chain = (
         {
         "query": lambda x: x["query"],
@@ -95,49 +190,243 @@ async def _refine_chunks(docs: List[Document], query: str) -> List[str]:
         | llm
         | StrOutputParser()
     )
-    
+
+    own_limiter = limiter is None
+    if own_limiter:
+        limiter = RateLimiter(REFINE_RPM, REFINE_TPM, REFINE_MAX_CONCURRENCY)
     tasks = []
-    for i, d in enumerate(docs):
-        t = _ainvoke_chain(chain, {"query": query, "doc": d}, delay=4*i)
-        tasks.append(t)
-    return await tqdm.gather(*tasks, desc="Refining")
+    docs = iter(docs)
+    while True:
+        # Split in a worker thread so the event loop keeps sending requests
+        d = await asyncio.to_thread(next, docs, None)
+        if d is None:
+            break
+        tasks.append(asyncio.ensure_future(_refine_chunk(chain, limiter, d, query)))
+    summaries = await tqdm.gather(*tasks, desc="Refining")
+    if own_limiter and limiter.nrate_limited > 0:
+        logging.info(f"Refine was rate limited {limiter.nrate_limited} times")
+    return summaries
 
 
-def _agg_summaries(summaries: List[str], query: str) -> str:
+def _drop_empty(summaries: List[str]) -> List[str]:
     """
-    Summarize step
+    Removes empty and near-empty summaries
     """
+    results = []
+    for s in summaries:
+        if len(s.strip().strip("\"'")) >= MIN_SUMMARY_CHARS:
+            results.append(s)
+    return results
+
+
+def _pack(summaries: List[str], budget: int) -> List[List[str]]:
+    """
+    Greedily packs summaries, in order, into groups of at most budget tokens.
+    A summary larger than the budget gets a group of its own.
+    """
+    groups = []
+    group = []
+    ntokens = 0
+    for s, n in zip(summaries, count_tokens_batch(summaries, MODEL_AGG)):
+        if len(group) > 0 and ntokens + n > budget:
+            groups.append(group)
+            group = []
+            ntokens = 0
+        group.append(s)
+        ntokens += n
+    if len(group) > 0:
+        groups.append(group)
+    return groups
+
+
+async def _agg_group(chain, limiter: RateLimiter, group: List[str],
+                     query: str) -> str:
+    """
+    Aggregates one group of summaries, serving it from the cache when possible.
+    A group of one is passed through as is.
+    """
+    if len(group) == 1:
+        return group[0]
+    cache = _summary_cache()
+    key = _agg_key(group, query)
+    summary = cache.get(key)
+    if summary is None:
+        input_ = {"summaries": "\n\n".join(group), "query": query}
+        ntokens = count_tokens(CHUNK_AGG_PROMPT + query + input_["summaries"],
+                               MODEL_AGG)
+        summary = await limiter.run(lambda: chain.ainvoke(input_),
+                                    ntokens + AGG_MAX_OUTPUT_TOKENS)
+        ledger.record(LEDGER_TOOL, MODEL_AGG, ntokens + AGG_MAX_OUTPUT_TOKENS)
+        cache.put(key, summary)
+    return summary
+
+
+async def _agg_summaries(summaries: List[str], query: str,
+                         llm: any=None) -> str:
+    """
+    Summarize step. Summaries are reduced as a tree: each level packs the
+    summaries into token-budgeted groups and aggregates the groups in
+    parallel until a single summary remains.
+    @param llm: Overrides the aggregation model. Useful for testing.
+    """
+    summaries = _drop_empty(summaries)
+    if len(summaries) == 0:
+        return NO_INFO_RESPONSE
+    if len(summaries) == 1:
+        return summaries[0]
+
     prompt = PromptTemplate.from_template(CHUNK_AGG_PROMPT)
-    llm = ChatOpenAI(temperature=MODEL_TEMP,
-                     model=MODEL_AGG)
-    chain = (
-        {
-        "summaries": lambda _: "\n\n".join(summaries),
-        "query": lambda x: x["query"],
-        }
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
+    if llm is None:
+        llm = ChatOpenAI(temperature=MODEL_TEMP,
+                         model=MODEL_AGG,
+                         max_retries=0)
+    chain = prompt | llm | StrOutputParser()
+    limiter = RateLimiter(AGG_RPM, AGG_TPM, AGG_MAX_CONCURRENCY)
 
-    with yaspin(Spinners.line, text="Summerizing"):
-        return chain.invoke({"summaries": summaries, "query": query})
+    for level in range(AGG_MAX_LEVELS):
+        # Past the last level everything goes into a single group
+        if level == AGG_MAX_LEVELS - 1:
+            groups = [summaries]
+        else:
+            groups = _pack(summaries, AGG_GROUP_TOKENS)
+            # Summaries over the budget each get a group of their own, so
+            # merge them in pairs to make sure every level shrinks the count
+            if len(groups) == len(summaries):
+                groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+        tasks = [_agg_group(chain, limiter, g, query) for g in groups]
+        summaries = await tqdm.gather(*tasks, desc=f"Summarizing (level {level})")
+        summaries = _drop_empty(summaries)
+        if len(summaries) == 0:
+            return NO_INFO_RESPONSE
+        if len(summaries) == 1:
+            return summaries[0]
 
 
-def refine_and_read(path: str, query: str, language: str=None) -> str:
+def _terms(text: str) -> List[str]:
     """
-    Splits a file into large chunks and refines each chunk into small summaries
-    based on a query. After refinement, the summaries are aggregated into one
-    final summary.
+    Lowercase alphanumeric terms of a text
+    """
+    return [t for t in re.findall(r"[a-z0-9_]+", text.lower()) if len(t) > 1]
+
+
+def _relevance_scores(docs: List[Document], query: str) -> List[float]:
+    """
+    A cheap tf-idf score of each chunk against the query
     """
-    if not os.path.exists(path):
-        raise FileNotFoundError
+    query_terms = set(_terms(query))
+    counts = []
+    for d in docs:
+        tf = {}
+        for t in _terms(d.page_content):
+            if t in query_terms:
+                tf[t] = tf.get(t, 0) + 1
+        counts.append(tf)
+    scores = []
+    for tf in counts:
+        score = 0.0
+        for t, n in tf.items():
+            df = sum(1 for c in counts if t in c)
+            score += (1 + math.log(n)) * math.log(1 + len(docs) / df)
+        scores.append(score)
+    return scores
+
+
+async def _is_complete(summaries: List[str], query: str, limiter: RateLimiter,
+                       llm: any=None) -> bool:
+    """
+    Asks the refine model if the summaries so far fully answer the query
+    @param limiter: The refine limiter of the job
+    """
+    notes = "\n\n".join(_drop_empty(summaries))
+    if len(notes) == 0:
+        return False
+    cache = _summary_cache()
+    key = make_key("complete", content_hash(notes), query,
+                   MODEL_REFINE, PROMPT_VERSION)
+    answer = cache.get(key)
+    if answer is None:
+        if llm is None:
+            llm = ChatOpenAI(temperature=MODEL_TEMP,
+                             model=MODEL_REFINE,
+                             max_retries=0)
+        prompt = PromptTemplate.from_template(COMPLETENESS_PROMPT)
+        chain = prompt | llm | StrOutputParser()
+        input_ = {"query": query, "notes": notes}
+        cost = count_tokens(COMPLETENESS_PROMPT + query + notes, MODEL_REFINE) + 1
+        answer = await limiter.run(lambda: chain.ainvoke(input_), cost)
+        ledger.record(LEDGER_TOOL, MODEL_REFINE, cost)
+        cache.put(key, answer)
+    return answer.strip().upper().startswith("YES")
+
+
+async def _progressive_refine(docs: List[Document], query: str,
+                              llm: any=None) -> Tuple[List[str], int]:
+    """
+    Refines chunks in waves, most relevant first, and stops as soon as
+    the summaries so far answer the query.
+    @param llm: Overrides the refine model. Useful for testing.
+    @return: The summaries in document order and the number of skipped chunks
+    """
+    scores = _relevance_scores(docs, query)
+    order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+    summaries = {}
+    ordered = []
+    limiter = RateLimiter(REFINE_RPM, REFINE_TPM, REFINE_MAX_CONCURRENCY)
+    for start in range(0, len(order), WAVE_SIZE):
+        wave = order[start:start + WAVE_SIZE]
+        results = await _refine_chunks([docs[i] for i in wave], query,
+                                       llm=llm, limiter=limiter)
+        summaries.update(zip(wave, results))
+        ordered = [summaries[i] for i in sorted(summaries)]
+        if start + WAVE_SIZE >= len(order):
+            break # Nothing left to skip
+        if await _is_complete(ordered, query, limiter, llm=llm):
+            break
+    if limiter.nrate_limited > 0:
+        logging.info(f"Refine was rate limited {limiter.nrate_limited} times")
+    return ordered, len(docs) - len(summaries)
+
+
+def refine_and_read_many(paths: List[str], query: str, language: str=None,
+                         progressive: bool=False) -> str:
+    """
+    Refines several files into one summary. Chunks that duplicate or nearly
+    duplicate a chunk seen earlier in the job, in any of the files, are
+    only refined once.
+    """
+    for path in paths:
+        if not os.path.exists(path):
+            raise FileNotFoundError
     if language is not None:
         check_language(language)
-    if language == "text":
-        language = None # Do nothing for language=text
-    docs = split_file(path, chunk_size=CHUNK_SIZE,
-                      chunk_overlap=CHUNK_OVERLAP,
-                      language=language)
-    summaries = asyncio.run(_refine_chunks(docs, query))
-    return _agg_summaries(summaries, query)
+    dedup = ChunkDeduplicator()
+    docs = itertools.chain.from_iterable(
+        iter_split_file(path, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS,
+                        MODEL_REFINE, language=language)
+        for path in paths)
+    docs = dedup.filter(docs)
+    if progressive:
+        docs = list(docs) # Ranking needs every chunk up front
+        summaries, nskipped = asyncio.run(_progressive_refine(docs, query))
+    else:
+        summaries = asyncio.run(_refine_chunks(docs, query))
+    summary = asyncio.run(_agg_summaries(summaries, query))
+    logging.info(f"Refine cache: {_summary_cache().stats()}")
+    logging.info(f"Deduplication saved {dedup.nduplicates} of {dedup.nseen} refine calls "
+                 f"({dedup.nexact} exact, {dedup.nnear} near duplicates)")
+    if progressive:
+        logging.info(f"Progressive refine skipped {nskipped} of {len(docs)} chunks")
+        summary += f"\n\n(Skipped {nskipped} of {len(docs)} chunks)"
+    return summary
+
+
+def refine_and_read(path: str, query: str, language: str=None,
+                    progressive: bool=False) -> str:
+    """
+    Splits a file into large chunks and refines each chunk into small summaries
+    based on a query. After refinement, the summaries are aggregated into one
+    final summary. In progressive mode the most relevant chunks are refined
+    first and the remaining chunks are skipped once the query is answered.
+    """
+    return refine_and_read_many([path], query, language=language,
+                                progressive=progressive)
@@ -0,0 +1,161 @@
+"""
+An adaptive scheduler for LLM requests that keeps throughput
+under the requests-per-minute and tokens-per-minute limits of
+the OpenAI API.
+"""
+
+from typing import Awaitable, Callable, Optional, TypeVar
+import time
+import random
+import asyncio
+import logging
+
+
+RATE_LIMIT_STATUS = 429
+MAX_RETRIES = 6
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+T = TypeVar("T")
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    """
+    Checks if an exception is a 429 response. Matches the openai
+    RateLimitError as well as any error carrying a 429 status code.
+    """
+    for attr in ("http_status", "status_code", "status"):
+        if getattr(e, attr, None) == RATE_LIMIT_STATUS:
+            return True
+    return type(e).__name__ == "RateLimitError"
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    """
+    Reads the Retry-After header of a rate limit error if present
+    """
+    headers = getattr(e, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", headers.get("Retry-After")))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+class TokenBucket:
+    """
+    A bucket holding up to `capacity` units that refills
+    continuously at `capacity` units per minute
+    """
+    def __init__(self, capacity: float, clock: Callable[[], float]):
+        self.capacity = capacity
+        self.level = capacity
+        self._rate = capacity / 60.0
+        self._clock = clock
+        self._last = clock()
+
+    def _refill(self):
+        """
+        Adds the units accumulated since the last refill
+        """
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._last) * self._rate)
+        self._last = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Seconds until `amount` units are available
+        """
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self._rate
+
+    def take(self, amount: float):
+        """
+        Removes units from the bucket
+        """
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def drain(self):
+        """
+        Empties the bucket
+        """
+        self._refill()
+        self.level = min(self.level, 0.0)
+
+
+class RateLimiter:
+    """
+    Admits requests against requests-per-minute and tokens-per-minute
+    budgets, caps the number of requests in flight and backs off
+    globally when the API responds with a 429.
+    Create one per event loop.
+    """
+    def __init__(self, rpm: int, tpm: int, max_concurrency: int,
+                 max_retries: int=MAX_RETRIES,
+                 clock: Callable[[], float]=time.monotonic):
+        """
+        @param rpm: Requests per minute budget
+        @param tpm: Tokens per minute budget
+        @param max_concurrency: Max number of requests in flight
+        @param max_retries: Number of retries of a request after a 429
+        @param clock: Monotonic clock in seconds. Overridable for tests.
+        """
+        self.max_retries = max_retries
+        self.nrequests = 0
+        self.nrate_limited = 0
+        self._clock = clock
+        self._requests = TokenBucket(rpm, clock)
+        self._tokens = TokenBucket(tpm, clock)
+        self._blocked_until = 0.0
+        self._admit = asyncio.Lock()
+        self._inflight = asyncio.Semaphore(max_concurrency)
+
+    async def _acquire(self, ntokens: int):
+        """
+        Waits until both budgets can admit a request of ntokens
+        """
+        async with self._admit:
+            while True:
+                wait = max(self._blocked_until - self._clock(),
+                           self._requests.wait_time(1),
+                           self._tokens.wait_time(ntokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self._requests.take(1)
+            self._tokens.take(ntokens)
+
+    def _backoff(self, e: Exception, attempt: int) -> float:
+        """
+        Pauses all admissions after a 429 and returns the pause length
+        """
+        delay = _retry_after(e)
+        if delay is None:
+            delay = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt)
+            delay *= 1 + random.random() / 2
+        self._blocked_until = max(self._blocked_until, self._clock() + delay)
+        self._tokens.drain()
+        return delay
+
+    async def run(self, fn: Callable[[], Awaitable[T]], ntokens: int) -> T:
+        """
+        Runs fn once the budgets admit it, retrying on 429 responses.
+        @param fn: A function returning the awaitable to run
+        @param ntokens: The estimated number of tokens used by the request
+        @return: The result of fn
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(ntokens)
+            async with self._inflight:
+                self.nrequests += 1
+                try:
+                    return await fn()
+                except Exception as e:
+                    if not is_rate_limit_error(e) or attempt == self.max_retries:
+                        raise
+                    self.nrate_limited += 1
+                    delay = self._backoff(e, attempt)
+                    logging.warning(f"Rate limited. Backing off for {delay:.1f}s")
@@ -0,0 +1,218 @@
+"""
+A local BM25 full-text index over the files of a cloned repository.
+Files are indexed as windows of lines so results point at file:line
+locations. The index is refreshed incrementally: only files whose
+size or modification time changed are read again.
+"""
+
+from typing import List, Tuple
+import os
+import re
+import math
+import logging
+import threading
+from ..ignore import walk_files
+from ..tokens import count_tokens
+
+
+WINDOW_LINES = 6
+MAX_FILE_BYTES = 1024 * 1024 # Larger files are likely generated or data
+MAX_LINE_CHARS = 200
+MAX_RESULT_TOKENS = 1500
+MAX_RESULTS = 20
+MODEL_NAME = "gpt-4"
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def _terms(text: str) -> List[str]:
+    """
+    Lowercase alphanumeric terms. Underscores and punctuation split terms
+    so cmake_minimum_required matches a query for cmake minimum.
+    """
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def _is_binary(path: str) -> bool:
+    """
+    Checks for a null byte at the start of a file
+    """
+    with open(path, "rb") as f:
+        return b"\0" in f.read(8192)
+
+
+class RepoIndex:
+    """
+    A BM25 index over the non-ignored text files of a directory
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        self._files = {}      # path -> (size, mtime_ns, [doc ids])
+        self._docs = {}       # doc id -> (path, first line, term counts, length)
+        self._postings = {}   # term -> {doc id: term count}
+        self._total_len = 0
+        self._next_id = 0
+
+    def _add_doc(self, path: str, line: int, text: str) -> int:
+        """
+        Indexes one window of lines
+        """
+        counts = {}
+        for t in _terms(text):
+            counts[t] = counts.get(t, 0) + 1
+        doc_id = self._next_id
+        self._next_id += 1
+        length = sum(counts.values())
+        self._docs[doc_id] = (path, line, counts, length)
+        self._total_len += length
+        for t, n in counts.items():
+            self._postings.setdefault(t, {})[doc_id] = n
+        return doc_id
+
+    def _remove_file(self, path: str):
+        """
+        Drops every window of a file from the index
+        """
+        _, _, doc_ids = self._files.pop(path)
+        for doc_id in doc_ids:
+            _, _, counts, length = self._docs.pop(doc_id)
+            self._total_len -= length
+            for t in counts:
+                postings = self._postings[t]
+                del postings[doc_id]
+                if len(postings) == 0:
+                    del self._postings[t]
+
+    def _add_file(self, path: str, size: int, mtime: int):
+        """
+        Splits a file into windows of lines and indexes them. The file
+        path is indexed along with the first window.
+        """
+        full = os.path.join(self.root, path)
+        doc_ids = []
+        if size <= MAX_FILE_BYTES and not _is_binary(full):
+            with open(full, "r", encoding="utf-8", errors="replace") as f:
+                lines = f.readlines()
+            for start in range(0, max(len(lines), 1), WINDOW_LINES):
+                text = "".join(lines[start:start + WINDOW_LINES])
+                if start == 0:
+                    text = path + "\n" + text
+                doc_ids.append(self._add_doc(path, start + 1, text))
+        self._files[path] = (size, mtime, doc_ids)
+
+    def refresh(self) -> Tuple[int, int]:
+        """
+        Brings the index up to date with the files on disk.
+        @return: The number of (re)indexed and removed files
+        """
+        with self._lock:
+            seen = set()
+            nindexed = 0
+            for path in walk_files(self.root):
+                try:
+                    st = os.stat(os.path.join(self.root, path))
+                except OSError:
+                    continue
+                seen.add(path)
+                known = self._files.get(path)
+                if known is not None and known[:2] == (st.st_size, st.st_mtime_ns):
+                    continue
+                if known is not None:
+                    self._remove_file(path)
+                try:
+                    self._add_file(path, st.st_size, st.st_mtime_ns)
+                    nindexed += 1
+                except OSError:
+                    continue
+            removed = [p for p in self._files if p not in seen]
+            for path in removed:
+                self._remove_file(path)
+            return nindexed, len(removed)
+
+    def search(self, query: str, limit: int=MAX_RESULTS) -> List[Tuple[str, int, float]]:
+        """
+        Ranks windows against the query with BM25
+        @return: (path, first line, score) of the best matching windows
+        """
+        with self._lock:
+            ndocs = len(self._docs)
+            if ndocs == 0:
+                return []
+            avg_len = self._total_len / ndocs
+            scores = {}
+            for t in set(_terms(query)):
+                postings = self._postings.get(t)
+                if postings is None:
+                    continue
+                idf = math.log(1 + (ndocs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    doc_len = self._docs[doc_id][3]
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_len / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+            best = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
+            return [(self._docs[d][0], self._docs[d][1], s) for d, s in best]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(root: str) -> RepoIndex:
+    """
+    The index of a directory. Indexes live for the life of the process.
+    """
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        if root not in _indexes:
+            _indexes[root] = RepoIndex(root)
+        return _indexes[root]
+
+
+def index_repo(root: str):
+    """
+    Builds or refreshes the index of a directory
+    """
+    nindexed, nremoved = get_index(root).refresh()
+    logging.info(f"Indexed {root}: {nindexed} files updated, {nremoved} removed")
+
+
+def index_repo_in_background(root: str):
+    """
+    Starts indexing a directory without blocking the caller
+    """
+    threading.Thread(target=index_repo, args=(root,), daemon=True).start()
+
+
+def _snippet(root: str, path: str, line: int) -> str:
+    """
+    The lines of a window prefixed with path:line
+    """
+    with open(os.path.join(root, path), "r", encoding="utf-8", errors="replace") as f:
+        lines = f.readlines()[line - 1:line - 1 + WINDOW_LINES]
+    body = "".join(l[:MAX_LINE_CHARS].rstrip() + "\n" for l in lines)
+    return f"{path}:{line}\n{body}"
+
+
+def search_repo(root: str, query: str, max_tokens: int=MAX_RESULT_TOKENS) -> List[str]:
+    """
+    Searches the files below root and returns file:line snippets
+    of the best matches that fit within max_tokens
+    """
+    if not os.path.isdir(root):
+        raise FileNotFoundError
+    index = get_index(root)
+    index.refresh()
+    results = []
+    ntokens = 0
+    for path, line, _ in index.search(query):
+        try:
+            snippet = _snippet(index.root, path, line)
+        except OSError:
+            continue
+        n = count_tokens(snippet, MODEL_NAME)
+        if ntokens + n > max_tokens:
+            break
+        results.append(snippet)
+        ntokens += n
+    return results
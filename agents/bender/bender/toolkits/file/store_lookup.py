@@ -1,43 +1,191 @@
 """
 Vectorstore tools for reading large files that are too big for
-the context window.
+the context window. Each cloned repository (at a given ref) has its
+own persistent index so repeated lookups only embed changed chunks.
 """
 
-from typing import List
+from typing import List, Tuple
 import os
+import re
+import json
+import hashlib
+import logging
+import functools
+import subprocess
 from langchain.vectorstores import Chroma
 from langchain.schema.document import Document
+from langchain.schema.embeddings import Embeddings
 from langchain.embeddings.openai import OpenAIEmbeddings
+from ..cache import DiskCache, cache_dir, content_hash, make_key
 from .utils import check_language, split_file
 
 
 CHUNK_SIZE = 3000
 CHUNK_OVERLAP = 100
+TOP_K = 1
 
+# Selects the embedding backend: "openai" or "hash" (deterministic and offline)
+EMBEDDINGS_ENV = "BENDER_EMBEDDINGS"
+DEFAULT_EMBEDDINGS = "openai"
+HASH_EMBEDDING_DIM = 256
+EMBEDDING_CACHE_MAX_BYTES = 256 * 1024 * 1024
 
-def _store_lookup(docs: List[Document], query: str) -> str:
+
+class HashEmbeddings(Embeddings):
+    """
+    A deterministic local embedder. Words are hashed into a fixed number
+    of buckets and the counts are L2 normalized. Only captures word
+    overlap, but needs no network access which makes it useful for tests.
+    """
+    def __init__(self, dim: int=HASH_EMBEDDING_DIM):
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        vec = [0.0] * self.dim
+        for word in re.findall(r"[a-z0-9_]+", text.lower()):
+            h = int.from_bytes(hashlib.md5(word.encode("utf-8")).digest()[:8], "little")
+            vec[h % self.dim] += 1.0
+        norm = sum(v * v for v in vec) ** 0.5
+        if norm > 0:
+            vec = [v / norm for v in vec]
+        return vec
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedder with an on-disk cache keyed by the hash of each text
+    so unchanged chunks are never embedded twice
+    """
+    def __init__(self, embeddings: Embeddings, name: str, cache: DiskCache):
+        """
+        @param embeddings: The embedder to wrap
+        @param name: Identifies the embedder and model in cache keys
+        @param cache: Where embeddings are stored
+        """
+        self.embeddings = embeddings
+        self.name = name
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [make_key(self.name, content_hash(t)) for t in texts]
+        results = [self.cache.get(k) for k in keys]
+        results = [json.loads(r) if r is not None else None for r in results]
+        misses = [i for i, r in enumerate(results) if r is None]
+        if len(misses) > 0:
+            vectors = self.embeddings.embed_documents([texts[i] for i in misses])
+            for i, v in zip(misses, vectors):
+                self.cache.put(keys[i], json.dumps(v))
+                results[i] = v
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
+@functools.lru_cache(maxsize=None)
+def get_embeddings() -> CachedEmbeddings:
+    """
+    The configured embedding backend wrapped with the embedding cache
+    """
+    backend = os.environ.get(EMBEDDINGS_ENV, DEFAULT_EMBEDDINGS)
+    if backend == "hash":
+        embeddings = HashEmbeddings()
+        name = f"hash:{HASH_EMBEDDING_DIM}"
+    elif backend == "openai":
+        embeddings = OpenAIEmbeddings()
+        name = f"openai:{embeddings.model}"
+    else:
+        raise ValueError(f"Unknown embedding backend {backend}")
+    path = os.path.join(cache_dir("vstore"), "embeddings.db")
+    cache = DiskCache(path, max_bytes=EMBEDDING_CACHE_MAX_BYTES)
+    return CachedEmbeddings(embeddings, name, cache)
+
+
+def _git(args: List[str], cwd: str) -> str:
+    """
+    Runs a git command and returns its stripped stdout
+    """
+    r = subprocess.run(["git"] + args, cwd=cwd, capture_output=True,
+                       text=True, check=True)
+    return r.stdout.strip()
+
+
+def _repo_identity(path: str) -> Tuple[str, str]:
+    """
+    The repository root containing path and the commit checked out.
+    Files outside of a git repository are indexed per directory.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        return _git(["rev-parse", "--show-toplevel"], directory), \
+               _git(["rev-parse", "HEAD"], directory)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return directory, "worktree"
+
+
+def _open_index(root: str, ref: str, embeddings: CachedEmbeddings) -> Chroma:
+    """
+    Opens the persistent index of a repository at a ref
+    """
+    name = "repo-" + make_key(root, ref, embeddings.name)[:32]
+    return Chroma(collection_name=name,
+                  embedding_function=embeddings,
+                  persist_directory=cache_dir("vstore", "chroma"))
+
+
+def _sync_file(db: Chroma, source: str, docs: List[Document]):
+    """
+    Brings the indexed chunks of one file up to date. Only chunks that
+    were not indexed before are added (and embedded).
+    """
+    ids = [make_key(source, str(i), content_hash(d.page_content))
+           for i, d in enumerate(docs)]
+    existing = set(db.get(where={"source": source}, include=[])["ids"])
+    stale = list(existing - set(ids))
+    if len(stale) > 0:
+        db.delete(stale)
+    new = [i for i, id_ in enumerate(ids) if id_ not in existing]
+    if len(new) > 0:
+        db.add_texts([docs[i].page_content for i in new],
+                     metadatas=[{"source": source, "chunk": i} for i in new],
+                     ids=[ids[i] for i in new])
+    logging.info(f"Indexed {source}: {len(new)} new, {len(stale)} stale, "
+                 f"{len(ids) - len(new)} unchanged chunks")
+
+
+def _store_lookup(db: Chroma, source: str, query: str,
+                  k: int) -> List[Tuple[Document, float]]:
     """
-    Build a vector store from documents and perform a query.
+    Queries the index for the top k chunks of a file with their distances
     """
-    db = Chroma.from_documents(docs, OpenAIEmbeddings())
-    docs = db.similarity_search(query)
-    return docs[0].page_content
+    return db.similarity_search_with_score(query, k=k, filter={"source": source})
 
 
 def vstore_and_read(path: str, query: str,
-                    language: str=None) -> str:
+                    language: str=None, k: int=TOP_K) -> str:
     """
     Splits a file into chunks based off the provided language
-    and creates a vectorstore. This store is queried and the
-    most relevant chunk is returned.
+    and indexes them in the persistent vectorstore of the file's
+    repository. This store is queried and the k most relevant chunks
+    are returned along with their distance to the query.
     """
     if not os.path.exists(path):
         raise FileNotFoundError
     if language is not None:
         check_language(language)
-    if language == "text":
-        language = None # Do nothing for language=text
     docs = split_file(path, chunk_size=CHUNK_SIZE,
                       chunk_overlap=CHUNK_OVERLAP,
                       language=language)
-    return _store_lookup(docs, query)
+    root, ref = _repo_identity(path)
+    db = _open_index(root, ref, get_embeddings())
+    source = os.path.relpath(os.path.abspath(path), root)
+    _sync_file(db, source, docs)
+    results = _store_lookup(db, source, query, k)
+    return "\n\n".join(f"[distance: {score:.3f}]\n{d.page_content}"
+                       for d, score in results)
@@ -1,6 +1,9 @@
+from typing import Iterator, Optional
+import os
 from langchain.document_loaders import TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-import tiktoken
+from langchain.schema.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter, Language
+from ..tokens import count_tokens
 from .exceptions import UnsupportedLanguage
 
 
@@ -10,6 +13,39 @@ LANGUAGES = ['text', 'cpp', 'go', 'java', 'kotlin',
              'markdown', 'latex', 'html', 'sol',
              'csharp']
 
+EXTENSION_LANGUAGES = {
+    ".c": "cpp", ".cc": "cpp", ".cpp": "cpp", ".cxx": "cpp",
+    ".h": "cpp", ".hh": "cpp", ".hpp": "cpp",
+    ".go": "go",
+    ".java": "java",
+    ".kt": "kotlin", ".kts": "kotlin",
+    ".js": "js", ".jsx": "js", ".mjs": "js", ".cjs": "js",
+    ".ts": "ts", ".tsx": "ts",
+    ".php": "php",
+    ".proto": "proto",
+    ".py": "python",
+    ".rst": "rst",
+    ".rb": "ruby",
+    ".rs": "rust",
+    ".scala": "scala",
+    ".swift": "swift",
+    ".md": "markdown", ".markdown": "markdown",
+    ".tex": "latex",
+    ".html": "html", ".htm": "html",
+    ".sol": "sol",
+    ".cs": "csharp",
+}
+
+SHEBANG_LANGUAGES = {
+    "python": "python",
+    "node": "js",
+    "ruby": "ruby",
+    "php": "php",
+}
+
+# Characters read per block by the streaming splitter
+READ_BLOCK_CHARS = 64 * 1024
+
 
 def check_language(language: str):
     """
@@ -19,11 +55,44 @@ def check_language(language: str):
         raise UnsupportedLanguage()
 
 
+def detect_language(path: str) -> str:
+    """
+    Infers the splitter language of a file from its extension or shebang.
+    Returns text if the language cannot be inferred.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in EXTENSION_LANGUAGES:
+        return EXTENSION_LANGUAGES[ext]
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            first = f.readline(256)
+    except OSError:
+        return "text"
+    if first.startswith("#!"):
+        for name, language in SHEBANG_LANGUAGES.items():
+            if name in first:
+                return language
+    return "text"
+
+
+def resolve_language(path: str, language: str=None) -> Optional[str]:
+    """
+    The language to split a file with. The language is inferred when
+    none is given. Returns None for plain text.
+    """
+    if language is None:
+        language = detect_language(path)
+    if language == "text":
+        return None
+    return language
+
+
 def split_file(path: str, chunk_size: int,
                 chunk_overlap: int, language: str=None):
     """
     Splits a file into chunks based on language
     """
+    language = resolve_language(path, language)
     loader = TextLoader(path)
     if language is None:
         splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size,
@@ -35,10 +104,42 @@ def split_file(path: str, chunk_size: int,
     return loader.load_and_split(splitter)
 
 
-def count_tokens(content: str, model_name: str) -> int:
+def iter_split_file(path: str, chunk_tokens: int, chunk_overlap: int,
+                    model_name: str, language: str=None) -> Iterator[Document]:
     """
-    Utility for counting tokens
+    Lazily splits a file into chunks of at most chunk_tokens tokens.
+    The file is read incrementally so memory use does not grow with
+    the size of the file.
     """
-    enc = tiktoken.encoding_for_model(model_name)
-    e = enc.encode(content)
-    return len(e)
\ No newline at end of file
+    language = resolve_language(path, language)
+    kwargs = {"chunk_size": chunk_tokens,
+              "chunk_overlap": chunk_overlap,
+              "length_function": lambda text: count_tokens(text, model_name)}
+    if language is not None:
+        kwargs["separators"] = RecursiveCharacterTextSplitter \
+            .get_separators_for_language(Language(language))
+        kwargs["is_separator_regex"] = True
+    # Start offsets let the unsplit tail of a block be carried over as is.
+    # The chunks themselves have their whitespace stripped.
+    splitter = RecursiveCharacterTextSplitter(add_start_index=True, **kwargs)
+
+    index = 0
+    buffer = ""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        while True:
+            block = f.read(READ_BLOCK_CHARS)
+            text = buffer + block
+            docs = splitter.create_documents([text])
+            chunks = [d.page_content for d in docs]
+            if len(block) == 0:
+                break
+            # The last chunk may continue in the next block so it is split again
+            for c in chunks[:-1]:
+                yield Document(page_content=c,
+                               metadata={"source": path, "chunk": index})
+                index += 1
+            buffer = text[docs[-1].metadata["start_index"]:] if len(docs) > 0 else ""
+    for c in chunks:
+        yield Document(page_content=c,
+                       metadata={"source": path, "chunk": index})
+        index += 1
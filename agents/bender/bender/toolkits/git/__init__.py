@@ -3,8 +3,10 @@ A collection of tools for working with git repositories
 """
 
 import logging
+from ..file.search import index_repo_in_background
 from .tools import list_branches_and_tags, clone
-from .exceptions import GitFatalError
+from .versions import resolve_version
+from .exceptions import GitFatalError, VersionNotFound
 
 
 def _try_clone_op(op: any, repository, *args) -> str:
@@ -30,7 +32,32 @@ def git_list_branches_and_tags(repository: str) -> str:
     logging.info(f"Listing branches and tags from {repository}\n{items}")
     return items
 
-    
+
+def git_resolve_version(repository: str, version: str) -> str:
+    """
+    Finds the branch or tag of the provided repository uri that holds the
+    requested version, e.g. 1.2.3, v1.2, 2.0.0-rc1 or cmd/foo/v1.2.3 for
+    monorepos. Use latest for the newest release. Handles v prefixes and
+    pre-release suffixes. Prefer this over git_list_branches_and_tags when
+    looking for a version. Returns the best matching ref and its commit
+    followed by a few alternatives. If no ref matches or the repository
+    does not exist, an error is returned.
+    """
+    logging.info(f"Resolving version {version} of {repository}...")
+    try:
+        best, alternatives = resolve_version(repository, version)
+    except GitFatalError as e:
+        logging.error(f"A fatal error occured: {str(e)}")
+        return "Error: " + str(e)
+    except VersionNotFound as e:
+        logging.error(str(e))
+        return "Error: " + str(e)
+    result = f"{best.ref.name} (commit {best.ref.commit})"
+    if alternatives:
+        result += "\nOther candidates: " + ", ".join(v.ref.name for v in alternatives)
+    logging.info(f"Resolved version {version} to {result}")
+    return result
+
 
 def git_clone(repository: str, branch_or_tag: str) -> str:
     """
@@ -40,4 +67,8 @@ def git_clone(repository: str, branch_or_tag: str) -> str:
     repository path if this is the case.
     """
     logging.info(f"Cloning {repository}...")
-    return _try_clone_op(clone, repository, branch_or_tag)
+    result = _try_clone_op(clone, repository, branch_or_tag)
+    if not result.startswith("Error"):
+        # Warm the full-text index so the first search is fast
+        index_repo_in_background(result)
+    return result
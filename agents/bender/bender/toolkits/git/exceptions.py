@@ -2,4 +2,11 @@ class GitFatalError(Exception):
     """
     Raised on any fatal error reported by git
     """
-    pass
\ No newline at end of file
+    pass
+
+
+class VersionNotFound(Exception):
+    """
+    Raised when no branch or tag matches a requested version
+    """
+    pass
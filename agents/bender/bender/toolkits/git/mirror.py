@@ -0,0 +1,208 @@
+"""
+A local store of bare mirrors of remote repositories. Clones are served
+from a mirror so that repeat runs do not download the same history again.
+Mirrors are refreshed incrementally with git fetch.
+"""
+
+from typing import List
+import os
+import re
+import time
+import fcntl
+import shutil
+import threading
+import contextlib
+import subprocess
+from ..cache import cache_dir, make_key
+from ..resources import ledger, reap
+from .exceptions import GitFatalError
+
+
+# How clones borrow from the mirror:
+#   shared:  objects are borrowed through alternates. Fastest, no copying.
+#   shallow: only the requested commit is copied (--depth 1).
+#   partial: commits and trees are copied, blobs are fetched on demand.
+#   sparse:  like shared, but only the top level directory is checked out.
+# The worktree mode of worktrees.py checks out a pooled worktree instead.
+CLONE_MODES = ["shared", "shallow", "partial", "sparse"]
+CLONE_MODE_ENV = "BENDER_CLONE_MODE"
+DEFAULT_CLONE_MODE = "shared"
+
+MIRROR_REFRESH_TTL = 10 * 60 # Seconds before a mirror is fetched again
+STALL_TIMEOUT = 60 # Kill git if it makes no progress for this long
+MIN_TIMEOUT = 60
+MAX_TIMEOUT = 60 * 60
+SECONDS_PER_MB = 0.5 # Timeouts grow with the size of the mirror
+POLL_INTERVAL = 0.5
+FETCHED_STAMP = "bender-fetched"
+
+
+def run_git(args: List[str], timeout: float) -> str:
+    """
+    Runs a git command. The command is killed if it runs longer than
+    timeout or if it writes no progress to stderr for STALL_TIMEOUT, so
+    large repositories may take long as long as they make progress.
+    @return: The stdout of the command
+    """
+    env = dict(os.environ, GIT_TERMINAL_PROMPT="0") # Fail instead of prompting
+    with ledger.measure("git", " ".join(["git"] + args)) as m:
+        p = subprocess.Popen(["git"] + args, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, env=env)
+        last_progress = [time.monotonic()]
+        stdout = []
+        stderr = []
+
+        def _drain(stream, out):
+            for chunk in iter(lambda: stream.read1(4096), b""):
+                out.append(chunk)
+                last_progress[0] = time.monotonic()
+
+        readers = [threading.Thread(target=_drain, args=(p.stdout, stdout), daemon=True),
+                   threading.Thread(target=_drain, args=(p.stderr, stderr), daemon=True)]
+        for r in readers:
+            r.start()
+        start = time.monotonic()
+        delay = 0.001
+        while reap(p, m, block=False) is None:
+            now = time.monotonic()
+            if now - start > timeout or now - last_progress[0] > STALL_TIMEOUT:
+                p.kill()
+                m.exit_code = reap(p, m)
+                m.timed_out = True
+                raise GitFatalError(f"git {args[0]} command failed")
+            time.sleep(delay)
+            delay = min(delay * 2, POLL_INTERVAL) # Short commands return quickly
+        for r in readers:
+            r.join()
+        m.exit_code = p.returncode
+    if p.returncode != 0:
+        raise GitFatalError(b"".join(stderr).decode("utf-8", errors="replace")
+                            .strip().replace("\n", ", "))
+    return b"".join(stdout).decode("utf-8", errors="replace")
+
+
+def _dir_size(path: str) -> int:
+    """
+    The total size in bytes of the files below a directory
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+
+def _timeout_for(path: str) -> float:
+    """
+    A timeout scaled to the size of a mirror
+    """
+    size_mb = _dir_size(path) / (1024 * 1024)
+    return min(MAX_TIMEOUT, MIN_TIMEOUT + size_mb * SECONDS_PER_MB)
+
+
+def mirror_path(repository: str) -> str:
+    """
+    The location of the mirror of a repository
+    """
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", repository.rstrip("/").split("/")[-1])
+    key = make_key(repository.rstrip("/"))[:16]
+    return os.path.join(cache_dir("git", "mirrors"), f"{key}-{name}")
+
+
+@contextlib.contextmanager
+def locked(path: str):
+    """
+    Holds an exclusive lock on a mirror across processes
+    """
+    with open(path + ".lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _has_ref(mirror: str, ref: str) -> bool:
+    """
+    Checks if a mirror has a branch or tag
+    """
+    for full in (f"refs/heads/{ref}", f"refs/tags/{ref}"):
+        r = subprocess.run(["git", "-C", mirror, "rev-parse", "--verify", "-q", full],
+                           capture_output=True)
+        if r.returncode == 0:
+            return True
+    return False
+
+
+def _is_stale(mirror: str) -> bool:
+    """
+    Checks if a mirror was last fetched more than MIRROR_REFRESH_TTL ago
+    """
+    try:
+        fetched = os.path.getmtime(os.path.join(mirror, FETCHED_STAMP))
+    except OSError:
+        return True
+    return time.time() - fetched > MIRROR_REFRESH_TTL
+
+
+def _mark_fetched(mirror: str):
+    """
+    Records that a mirror was just fetched
+    """
+    with open(os.path.join(mirror, FETCHED_STAMP), "w", encoding="utf-8") as f:
+        f.write(str(time.time()))
+
+
+def ensure_mirror(repository: str, branch_or_tag: str=None) -> str:
+    """
+    Creates or refreshes the mirror of a repository. An existing mirror is
+    only fetched if it is stale or is missing the requested ref.
+    @return: The path of the mirror
+    """
+    path = mirror_path(repository)
+    with locked(path):
+        if not os.path.exists(path):
+            tmp = path + ".tmp"
+            shutil.rmtree(tmp, ignore_errors=True)
+            run_git(["clone", "--mirror", "--progress", repository, tmp], MAX_TIMEOUT)
+            # Shared clones borrow objects, so the mirror must never prune them
+            run_git(["-C", tmp, "config", "gc.auto", "0"], MIN_TIMEOUT)
+            run_git(["-C", tmp, "config", "uploadpack.allowFilter", "true"], MIN_TIMEOUT)
+            os.rename(tmp, path)
+            _mark_fetched(path)
+        elif _is_stale(path) or (branch_or_tag and not _has_ref(path, branch_or_tag)):
+            run_git(["-C", path, "fetch", "--prune", "--progress", "origin"],
+                     _timeout_for(path))
+            _mark_fetched(path)
+    return path
+
+
+def clone_from_mirror(repository: str, branch_or_tag: str, dest: str,
+                      mode: str=None):
+    """
+    Clones a repository into dest using the local mirror as the source.
+    The origin remote of the clone still points at repository.
+    @param mode: One of CLONE_MODES. Defaults to the BENDER_CLONE_MODE env var.
+    """
+    if mode is None:
+        mode = os.environ.get(CLONE_MODE_ENV, DEFAULT_CLONE_MODE)
+    if mode not in CLONE_MODES:
+        raise GitFatalError(f"Unknown clone mode {mode}")
+    mirror = ensure_mirror(repository, branch_or_tag)
+
+    args = ["clone", "--progress"]
+    if branch_or_tag:
+        args += ["-b", branch_or_tag]
+    if mode == "shared":
+        args += ["--shared", mirror]
+    elif mode == "shallow":
+        args += ["--depth", "1", "file://" + mirror] # --depth is ignored for plain paths
+    elif mode == "partial":
+        args += ["--filter=blob:none", "file://" + mirror]
+    elif mode == "sparse":
+        args += ["--shared", "--sparse", mirror]
+    run_git(args + [dest], _timeout_for(mirror))
+    run_git(["-C", dest, "remote", "set-url", "origin", repository], MIN_TIMEOUT)
@@ -1,61 +1,140 @@
-from typing import List
+from typing import Dict, List
+import os
+import json
+import functools
 import subprocess
-import shutil
+from ..cache import DiskCache, cache_dir, make_key
+from ..resources import ledger
+from .mirror import clone_from_mirror, CLONE_MODE_ENV, DEFAULT_CLONE_MODE
+from .worktrees import checkout_worktree, WORKTREE_MODE
 from .exceptions import GitFatalError
 
 
-GIT_FATAL_ERRNO = 128
-CLONE_TIMEOUT = 60
+LS_REMOTE_TIMEOUT = 30
+REFS_CACHE_TTL = 10 * 60 # Seconds before listed refs are fetched again
+PEELED_SUFFIX = "^{}"
+
+
+class GitRef:
+    """
+    A branch or tag advertised by a remote
+    """
+    def __init__(self, name: str, sha: str, peeled: str=None):
+        """
+        @param name: The short name of the ref, e.g. main or v1.2.3
+        @param sha: The object the ref points to
+        @param peeled: For annotated tags, the commit the tag points to
+        """
+        self.name = name
+        self.sha = sha
+        self.peeled = peeled
+
+    @property
+    def commit(self) -> str:
+        """
+        The commit the ref resolves to
+        """
+        return self.peeled if self.peeled is not None else self.sha
+
+    def as_dict(self) -> Dict:
+        """
+        The JSON serializable form of the ref
+        """
+        return {"name": self.name, "sha": self.sha, "peeled": self.peeled}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "GitRef":
+        """
+        Inverse of as_dict
+        """
+        return cls(data["name"], data["sha"], data.get("peeled"))
 
 
 def _clone(repository: str, branch_or_tag: str=None) -> str:
     """
-    Clones a git repo
+    Clones a git repo. The clone is served from a local mirror of the
+    repository which is created on first use and fetched when stale.
+    In worktree mode the repo is a link to a pooled worktree of the mirror.
     """
-    cmd = "git clone"
-    if branch_or_tag:
-        cmd += " -b " + branch_or_tag
-    cmd += " " + repository
-    try:
-        r = subprocess.run(cmd, shell=True, capture_output=True, timeout=CLONE_TIMEOUT) #TODO: shel=True is dangerous
-        if r.returncode == GIT_FATAL_ERRNO:
-            raise GitFatalError(r.stderr.decode("utf-8").replace("\n", ", "))
-        repo_name = repository.split("/")[-1]
-        repo_name = repo_name.split(".")[0]
-        return repo_name
-    except subprocess.TimeoutExpired:
-        raise GitFatalError("git clone command failed")
-
-
-def _list_branches(repo_name: str) -> List[str]:
+    repo_name = repository.rstrip("/").split("/")[-1]
+    repo_name = repo_name.split(".")[0]
+    mode = os.environ.get(CLONE_MODE_ENV, DEFAULT_CLONE_MODE)
+    if mode == WORKTREE_MODE:
+        checkout_worktree(repository, branch_or_tag, repo_name)
+    else:
+        clone_from_mirror(repository, branch_or_tag, repo_name, mode)
+    return repo_name
+
+
+@functools.lru_cache(maxsize=None)
+def _refs_cache() -> DiskCache:
     """
-    List the branches of a git repo
+    The on-disk cache of listed refs
     """
-    cmd = f"cd {repo_name} && git branch -a"
-    branches = subprocess.check_output(cmd, shell=True)
-    return branches.decode("utf-8").split("\n")
+    return DiskCache(os.path.join(cache_dir("git"), "refs.db"))
 
 
-def _list_tags(repo_name: str) -> List[str]:
+def _parse_ls_remote(output: str) -> Dict[str, List[GitRef]]:
     """
-    List the tags of a git repo
+    Parses the output of git ls-remote into branches and tags.
+    Peeled entries (refs/tags/v1^{}) are folded into their tag.
     """
-    cmd = f"cd {repo_name} && git tag"
-    tags = subprocess.check_output(cmd, shell=True)
-    return tags.decode("utf-8").split("\n")
+    branches = []
+    tags = {}
+    for line in output.splitlines():
+        if "\t" not in line:
+            continue
+        sha, ref = line.split("\t", 1)
+        if ref.startswith("refs/heads/"):
+            branches.append(GitRef(ref[len("refs/heads/"):], sha))
+        elif ref.startswith("refs/tags/"):
+            name = ref[len("refs/tags/"):]
+            if name.endswith(PEELED_SUFFIX):
+                name = name[:-len(PEELED_SUFFIX)]
+                tags.setdefault(name, GitRef(name, None)).peeled = sha
+            else:
+                tags.setdefault(name, GitRef(name, sha)).sha = sha
+    return {"branches": branches, "tags": list(tags.values())}
+
+
+def ls_remote(repository: str) -> Dict[str, List[GitRef]]:
+    """
+    Lists the branches and tags of a remote from its ref advertisement
+    without fetching any objects. Results are cached per repository.
+    """
+    cache = _refs_cache()
+    key = make_key("ls-remote", repository.rstrip("/"))
+    cached = cache.get(key, ttl=REFS_CACHE_TTL)
+    if cached is not None:
+        data = json.loads(cached)
+        return {kind: [GitRef.from_dict(r) for r in refs]
+                for kind, refs in data.items()}
+
+    cmd = ["git", "ls-remote", "--heads", "--tags", repository]
+    env = dict(os.environ, GIT_TERMINAL_PROMPT="0") # Fail instead of prompting
+    with ledger.measure("git", " ".join(cmd)) as m:
+        try:
+            r = subprocess.run(cmd, capture_output=True, env=env,
+                               timeout=LS_REMOTE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            m.timed_out = True
+            raise GitFatalError("git ls-remote command failed")
+        m.exit_code = r.returncode
+    if r.returncode != 0:
+        raise GitFatalError(r.stderr.decode("utf-8").replace("\n", ", "))
+    refs = _parse_ls_remote(r.stdout.decode("utf-8"))
+    cache.put(key, json.dumps({kind: [r.as_dict() for r in refs]
+                               for kind, refs in refs.items()}))
+    return refs
 
 
 def list_branches_and_tags(repository: str) -> str:
     """
     Returns a comma separated list of the tags and branches of a git repo
     """
-    # TODO: Update this to be a checkout and switch branch instead of
-    # cloning twice.
-    repo_name = _clone(repository)
-    branches = _list_branches(repo_name)
-    tags = _list_tags(repo_name)
-    shutil.rmtree(repo_name) # TODO: Dangerous
-    return ", ".join(branches + tags)
+    refs = ls_remote(repository)
+    return ", ".join([r.name for r in refs["branches"]] +
+                     [r.name for r in refs["tags"]])
 
 
 def clone(repository: str, branch_or_tag: str) -> str:
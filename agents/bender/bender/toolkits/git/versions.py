@@ -0,0 +1,167 @@
+"""
+Maps a requested version such as 1.2, v1.2.3-rc1 or latest to the
+branch or tag of a repository that holds it.
+"""
+
+from typing import Dict, List, Optional, Tuple
+import re
+from .tools import GitRef, ls_remote
+from .exceptions import VersionNotFound
+
+
+LATEST = "latest"
+MAX_ALTERNATIVES = 3
+FULL_VERSION_PARTS = 3 # major.minor.patch
+
+# An optional prefix (cmd/foo/, release-, go), an optional v, up to four
+# numeric components separated by . or _ and an optional suffix
+VERSION_RE = re.compile(r"^(?P<prefix>(?:.*?[^0-9.])?)"
+                        r"[vV]?(?P<nums>\d+(?:[._]\d+){0,3})"
+                        r"(?P<suffix>[-.+~]?[0-9A-Za-z][0-9A-Za-z.+~-]*)?$")
+PRE_PART_RE = re.compile(r"\d+|[A-Za-z]+")
+NUM_PARTS = 4
+
+
+class Version:
+    """
+    A ref parsed into a version that can be ordered
+    """
+    def __init__(self, prefix: str, nums: Tuple[int, ...], pre: str,
+                 ref: GitRef=None, is_tag: bool=True):
+        """
+        @param prefix: Anything before the version, e.g. cmd/foo/
+        @param nums: The numeric components of the version
+        @param pre: The pre-release suffix, e.g. rc1. Empty for releases
+        @param ref: The ref the version was parsed from
+        @param is_tag: False if the ref is a branch
+        """
+        self.prefix = prefix
+        self.nums = nums
+        self.pre = pre
+        self.ref = ref
+        self.is_tag = is_tag
+
+    @classmethod
+    def parse(cls, name: str, ref: GitRef=None,
+              is_tag: bool=True) -> Optional["Version"]:
+        """
+        Parses a ref name. Returns None if it does not contain a version.
+        """
+        m = VERSION_RE.match(name.strip())
+        if m is None:
+            return None
+        nums = tuple(int(n) for n in re.split(r"[._]", m.group("nums")))
+        suffix = (m.group("suffix") or "").split("+")[0] # Build metadata is ignored
+        pre = suffix.lstrip("-.~").lower()
+        return cls(m.group("prefix"), nums, pre, ref, is_tag)
+
+    @property
+    def is_prerelease(self) -> bool:
+        return self.pre != ""
+
+    def padded(self) -> Tuple[int, ...]:
+        """
+        The numeric components padded with zeros so 1.2 == 1.2.0
+        """
+        return self.nums + (0,) * (NUM_PARTS - len(self.nums))
+
+    def sort_key(self) -> Tuple:
+        """
+        Orders versions like semver: releases come after their pre-releases
+        and numeric pre-release parts compare as numbers
+        """
+        pre = tuple((0, int(p), "") if p.isdigit() else (1, 0, p)
+                    for p in PRE_PART_RE.findall(self.pre))
+        return (self.padded(), not self.is_prerelease, pre, self.is_tag)
+
+    def matches(self, requested: "Version") -> bool:
+        """
+        Checks if this version falls under a requested one. 1.2 matches 1.2,
+        1.2.0 and 1.2.7. A requested pre-release only matches itself.
+        """
+        n = len(requested.nums)
+        if self.padded()[:n] != requested.padded()[:n]:
+            return False
+        if requested.is_prerelease:
+            return self.pre == requested.pre
+        return True
+
+    def __str__(self) -> str:
+        return self.ref.name if self.ref is not None else \
+            self.prefix + ".".join(str(n) for n in self.nums) + \
+            (("-" + self.pre) if self.pre else "")
+
+
+class VersionIndex:
+    """
+    The versioned refs of a repository grouped by prefix and
+    sorted from newest to oldest
+    """
+    def __init__(self, refs: Dict[str, List[GitRef]]):
+        """
+        @param refs: Branches and tags as returned by ls_remote
+        """
+        self.by_prefix = {}
+        for kind in ("tags", "branches"):
+            for ref in refs.get(kind, []):
+                v = Version.parse(ref.name, ref, is_tag=(kind == "tags"))
+                if v is not None:
+                    self.by_prefix.setdefault(self._norm(v.prefix), []).append(v)
+        for versions in self.by_prefix.values():
+            versions.sort(key=Version.sort_key, reverse=True)
+
+    @staticmethod
+    def _norm(prefix: str) -> str:
+        """
+        Prefixes are compared without case and a trailing v
+        """
+        return prefix.lower().rstrip("v")
+
+    def _candidates(self, prefix: str) -> List[Version]:
+        """
+        The versions to consider for a requested prefix. Without a prefix,
+        unprefixed versions win over monorepo ones if there are any.
+        """
+        if prefix:
+            return self.by_prefix.get(self._norm(prefix), [])
+        if "" in self.by_prefix:
+            return self.by_prefix[""]
+        return sorted((v for vs in self.by_prefix.values() for v in vs),
+                      key=Version.sort_key, reverse=True)
+
+    def resolve(self, version: str) -> List[Version]:
+        """
+        The versions matching a request, best match first
+        @param version: A version such as 1.2.3, v1.2, cmd/foo/v1.2.3, latest
+                        or cmd/foo/latest
+        """
+        version = version.strip()
+        if version.lower().endswith(LATEST) or version == "":
+            prefix = version[:len(version) - len(LATEST)] if version else ""
+            candidates = self._candidates(prefix)
+            releases = [v for v in candidates if not v.is_prerelease]
+            return releases or candidates
+        requested = Version.parse(version)
+        if requested is None:
+            return []
+        matches = [v for v in self._candidates(requested.prefix)
+                   if v.matches(requested)]
+        if not requested.is_prerelease and any(not v.is_prerelease for v in matches):
+            matches = [v for v in matches if not v.is_prerelease]
+        # A full version (1.2.3 -> tag 1.2.3.0) is taken as is. A partial
+        # one (1 or 1.2) stands for the newest release in its range.
+        if len(requested.nums) < FULL_VERSION_PARTS:
+            return matches
+        exact = [v for v in matches if v.padded() == requested.padded()]
+        return exact + [v for v in matches if v not in exact]
+
+
+def resolve_version(repository: str, version: str) -> Tuple[Version, List[Version]]:
+    """
+    Finds the branch or tag of a repository holding a version
+    @return: The best match and up to MAX_ALTERNATIVES runner ups
+    """
+    matches = VersionIndex(ls_remote(repository)).resolve(version)
+    if len(matches) == 0:
+        raise VersionNotFound(f"No branch or tag matches version {version}")
+    return matches[0], matches[1:1 + MAX_ALTERNATIVES]
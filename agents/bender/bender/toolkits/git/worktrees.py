@@ -0,0 +1,142 @@
+"""
+A pool of git worktrees on top of the repository mirrors. Concurrent runs
+against the same repository share the mirror's object store and each get
+an isolated checkout. Checkouts are reset and reused between runs instead
+of being deleted.
+"""
+
+from typing import Dict
+import os
+import fcntl
+import shutil
+import subprocess
+from ..cache import cache_dir
+from .mirror import ensure_mirror, mirror_path, locked, run_git, MIN_TIMEOUT
+from .exceptions import GitFatalError
+
+
+MAX_WORKTREES = 16 # Per repository
+SLOT_PREFIX = "slot-"
+WORKTREE_MODE = "worktree"
+
+
+class WorktreePool:
+    """
+    Hands out worktrees of one repository. A worktree is held through a
+    file lock until release() is called or the process exits, so runs in
+    other processes (or containers sharing the cache) never get the same one.
+    """
+    def __init__(self, repository: str, max_worktrees: int=MAX_WORKTREES):
+        """
+        @param repository: The remote url of the repository
+        @param max_worktrees: The number of worktrees that may exist at once
+        """
+        self.repository = repository
+        self.max_worktrees = max_worktrees
+        self.root = cache_dir("git", "worktrees",
+                              os.path.basename(mirror_path(repository)))
+        self._held = {} # Worktree path -> open lock file
+
+    def _resolve(self, mirror: str, branch_or_tag: str=None) -> str:
+        """
+        The commit of a branch or tag in the mirror. Defaults to HEAD.
+        """
+        ref = branch_or_tag or "HEAD"
+        for name in (f"refs/heads/{ref}", f"refs/tags/{ref}", ref):
+            r = subprocess.run(["git", "-C", mirror, "rev-parse", "--verify", "-q",
+                                name + "^{commit}"], capture_output=True)
+            if r.returncode == 0:
+                return r.stdout.decode("utf-8").strip()
+        raise GitFatalError(f"Remote branch {branch_or_tag} not found")
+
+    def _try_lock(self, path: str):
+        """
+        Takes the lock of a worktree without waiting.
+        @return: The open lock file or None if another run holds it
+        """
+        f = open(path + ".lock", "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+        return f
+
+    def _reset(self, path: str, commit: str):
+        """
+        Moves a recycled worktree to a commit and removes everything
+        a previous run left behind
+        """
+        run_git(["-C", path, "checkout", "--quiet", "--force", "--detach", commit],
+                MIN_TIMEOUT)
+        run_git(["-C", path, "clean", "-ffdxq"], MIN_TIMEOUT)
+
+    def _create(self, mirror: str, path: str, commit: str):
+        """
+        Adds a new worktree to the mirror
+        """
+        shutil.rmtree(path, ignore_errors=True)
+        with locked(mirror):
+            run_git(["-C", mirror, "worktree", "prune"], MIN_TIMEOUT)
+            run_git(["-C", mirror, "worktree", "add", "--quiet", "--force",
+                     "--detach", path, commit], MIN_TIMEOUT)
+
+    def acquire(self, branch_or_tag: str=None) -> str:
+        """
+        Checks out a branch or tag into a free worktree
+        @return: The path of the worktree
+        """
+        mirror = ensure_mirror(self.repository, branch_or_tag)
+        commit = self._resolve(mirror, branch_or_tag)
+        for i in range(self.max_worktrees):
+            path = os.path.join(self.root, f"{SLOT_PREFIX}{i}")
+            lock = self._try_lock(path)
+            if lock is None:
+                continue
+            try:
+                if os.path.exists(os.path.join(path, ".git")):
+                    try:
+                        self._reset(path, commit)
+                    except GitFatalError:
+                        self._create(mirror, path, commit) # Broken worktree
+                else:
+                    self._create(mirror, path, commit)
+            except GitFatalError:
+                lock.close()
+                raise
+            self._held[path] = lock
+            return path
+        raise GitFatalError(f"All {self.max_worktrees} worktrees of "
+                            f"{self.repository} are in use")
+
+    def release(self, path: str):
+        """
+        Returns a worktree to the pool. Its files are kept and reset
+        by the next run that acquires it.
+        """
+        lock = self._held.pop(path, None)
+        if lock is not None:
+            lock.close()
+
+
+_pools: Dict[str, WorktreePool] = {}
+
+
+def get_pool(repository: str) -> WorktreePool:
+    """
+    The worktree pool of a repository
+    """
+    key = repository.rstrip("/")
+    if key not in _pools:
+        _pools[key] = WorktreePool(key)
+    return _pools[key]
+
+
+def checkout_worktree(repository: str, branch_or_tag: str, dest: str):
+    """
+    Checks out a branch or tag into a pooled worktree and links it to dest
+    """
+    if os.path.lexists(dest):
+        raise GitFatalError(f"destination path '{dest}' already exists")
+    path = get_pool(repository).acquire(branch_or_tag)
+    os.symlink(path, dest)
@@ -0,0 +1,145 @@
+"""
+A small .gitignore matcher and a directory walker that respects it
+"""
+
+from typing import Iterator
+import os
+import re
+
+
+GITIGNORE = ".gitignore"
+ALWAYS_IGNORED = {".git"}
+
+
+def _translate(pattern: str) -> str:
+    """
+    Translates a gitignore glob into a regex
+    """
+    i = 0
+    out = ""
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            out += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+            out += "/.*"
+            i += 3
+        elif pattern[i] == "*":
+            out += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            out += "[^/]"
+            i += 1
+        elif pattern[i] == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                out += re.escape(pattern[i])
+                i += 1
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out += "[" + body.replace("\\", "\\\\") + "]"
+                i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            out += re.escape(pattern[i + 1])
+            i += 2
+        else:
+            out += re.escape(pattern[i])
+            i += 1
+    return out
+
+
+class GitIgnore:
+    """
+    Ignore rules collected from .gitignore files. Rules from a .gitignore
+    only apply below the directory that contains it and later rules
+    take precedence over earlier ones.
+    """
+    def __init__(self):
+        self._rules = []
+
+    def add_pattern(self, pattern: str, base: str=""):
+        """
+        Adds one gitignore pattern.
+        @param pattern: The pattern as written in a .gitignore
+        @param base: The directory of the .gitignore relative to the root
+        """
+        pattern = pattern.rstrip("\n").rstrip()
+        if len(pattern) == 0 or pattern.startswith("#"):
+            return
+        negate = pattern.startswith("!")
+        if negate:
+            pattern = pattern[1:]
+        dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        if len(pattern) == 0:
+            return
+        anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+        regex = _translate(pattern)
+        if not anchored:
+            regex = "(?:.*/)?" + regex
+        self._rules.append((base, re.compile(regex + "$"), negate, dir_only))
+
+    def add_file(self, path: str, base: str=""):
+        """
+        Adds every pattern of a .gitignore file
+        """
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    self.add_pattern(line, base)
+        except OSError:
+            pass
+
+    def is_ignored(self, relpath: str, is_dir: bool) -> bool:
+        """
+        Checks if a path relative to the root is ignored
+        """
+        ignored = False
+        for base, regex, negate, dir_only in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if base:
+                if not relpath.startswith(base + "/"):
+                    continue
+                path = relpath[len(base) + 1:]
+            else:
+                path = relpath
+            if regex.match(path):
+                ignored = not negate
+        return ignored
+
+
+def walk_files(root: str, ignore: GitIgnore=None) -> Iterator[str]:
+    """
+    Yields the paths, relative to root, of all files below root that
+    are not ignored. .gitignore files are picked up along the way.
+    """
+    if ignore is None:
+        ignore = GitIgnore()
+        ignore.add_file(os.path.join(root, ".git", "info", "exclude"))
+    stack = [""]
+    while len(stack) > 0:
+        rel = stack.pop()
+        directory = os.path.join(root, rel)
+        ignore.add_file(os.path.join(directory, GITIGNORE), rel)
+        try:
+            entries = sorted(os.scandir(directory), key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirs = []
+        for e in entries:
+            if e.name in ALWAYS_IGNORED:
+                continue
+            path = e.name if rel == "" else rel + "/" + e.name
+            is_dir = e.is_dir(follow_symlinks=False)
+            if ignore.is_ignored(path, is_dir):
+                continue
+            if is_dir:
+                subdirs.append(path)
+            elif e.is_file(follow_symlinks=False):
+                yield path
+        stack.extend(reversed(subdirs))
+
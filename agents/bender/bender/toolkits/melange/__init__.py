@@ -3,18 +3,40 @@ A collection of tools for build melange YAML files.
 """
 
 
+from typing import Any, Callable, Dict, Union
+import inspect
 import logging
-from .tools import (add_header,
-                    add_build_dependency,
-                    add_pipeline_runs,
-                    add_pipeline_git_checkout,
-                    add_pipeline_go_build,
-                    write_model)
-from .exceptions import MissingMelangeHeader
+import functools
+from langchain.tools import BaseTool, StructuredTool
+from .tools import MelangeSession, open_session, get_session, close_session
+from .spec import MelangeSpec
+from .exceptions import MissingMelangeHeader, InvalidMelangeSpec, InvalidMelangeModel
 
 
-def melange_add_header(package: str, version: str, description: str,
-                       license: str) -> str:
+def bind_session(func: Callable, session: MelangeSession) -> Callable:
+    """
+    Binds a melange tool to a session. The session parameter is hidden
+    from the signature so that it does not show up in the tool's schema.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return func(session, *args, **kwargs)
+    sig = inspect.signature(func)
+    wrapper.__signature__ = sig.replace(parameters=list(sig.parameters.values())[1:])
+    return wrapper
+
+
+def _invalid_model(e: InvalidMelangeModel) -> str:
+    """
+    Formats the problems in a rejected change for the agent
+    """
+    errors = e.args[0]
+    logging.error(f"Invalid melange model: {errors}")
+    return "Error: The melange model would be invalid:\n" + "\n".join(errors)
+
+
+def melange_add_header(session: MelangeSession, package: str, version: str,
+                       description: str, license: str) -> str:
     """
     Initializes a melange YAML model with the provided metadata.
     Calling this function multiple times will discard the previous
@@ -22,15 +44,18 @@ def melange_add_header(package: str, version: str, description: str,
     package: The name of the package
     version: The version of the package
     description: A one sentence description of the package
-    license: The package's license
+    license: The package's license as an SPDX id or expression, e.g. MIT
     """
     logging.info(f"Initializing Melange YAML for {package}=={version}")
     logging.info(f"\tname: {package}, version: {version}, license: {license}, desc: {description}")
-    add_header(package, version, description, license)
+    try:
+        session.add_header(package, version, description, license)
+    except InvalidMelangeModel as e:
+        return _invalid_model(e)
     return "Success"
 
 
-def melange_add_build_dependency(package: str) -> str:
+def melange_add_build_dependency(session: MelangeSession, package: str) -> str:
     """
     Adds a package to the list of build-time dependencies of an
     initialized melange YAML model.
@@ -39,14 +64,16 @@ def melange_add_build_dependency(package: str) -> str:
     """
     logging.info(f"Adding dependency {package}")
     try:
-        add_build_dependency(package)
+        session.add_build_dependency(package)
     except MissingMelangeHeader:
         logging.error("No melange header is initialized")
         return "Error: Must first add a melange header."
+    except InvalidMelangeModel as e:
+        return _invalid_model(e)
     return "Success"
 
 
-def melange_add_pipeline_runs(command: str) -> str:
+def melange_add_pipeline_runs(session: MelangeSession, command: str) -> str:
     """
     Adds a generic run pipeline step to an initialized
     melange YAML model. An error is returned if no model has
@@ -56,15 +83,17 @@ def melange_add_pipeline_runs(command: str) -> str:
     """
     logging.info(f"Adding `runs` pipeline stage: {command}")
     try:
-        add_pipeline_runs(command)
+        session.add_pipeline_runs(command)
     except MissingMelangeHeader:
         logging.error("No melange header is initialized")
         return "Error: Must first add a melange header."
+    except InvalidMelangeModel as e:
+        return _invalid_model(e)
     return "Success"
 
 
-def melange_add_pipeline_git_checkout(repository: str, branch: str=None,
-                                      tag: str=None) -> str:
+def melange_add_pipeline_git_checkout(session: MelangeSession, repository: str,
+                                      branch: str=None, tag: str=None) -> str:
     """
     Adds a git-checkout pipeline step to an initialized
     melange YAML model. An error is returned if no model
@@ -82,21 +111,24 @@ def melange_add_pipeline_git_checkout(repository: str, branch: str=None,
         msg += f", tag: {tag}"
     logging.info(msg)
     try:
-        add_pipeline_git_checkout(repository, branch, tag)
+        session.add_pipeline_git_checkout(repository, branch, tag)
     except MissingMelangeHeader:
         logging.error("No melange header is initialized")
         return "Error: Must first add a melange header."
+    except InvalidMelangeModel as e:
+        return _invalid_model(e)
     return "Success"
 
 
-def melange_add_pipeline_go_build(packages: str, output: str,
-                                  modroot: str=None, prefix: str=None,
+def melange_add_pipeline_go_build(session: MelangeSession, packages: str,
+                                  output: str, modroot: str=None, prefix: str=None,
                                   ldflags: str=None, install_dir: str=None) -> str:
     """
     Adds a go/build pipeline step to an initialized
     melange YAML model. An error is returned if no model
     has been initialized. Go/build steps build and install
-    go projects. Use the default values when possible.
+    go projects. Must come after a git-checkout step.
+    Use the default values when possible.
     packages: Space-separated packages to compile. Files can also be specified.
               This value is passed to go build. Paths are relative to modroot.
     output: Name of the output binary. The final install location will be
@@ -119,15 +151,57 @@ def melange_add_pipeline_go_build(packages: str, output: str,
     logging.info(f"Adding `go/build` pipeline stage")
     logging.info(msg)
     try:
-        add_pipeline_go_build(packages, output, modroot, prefix,
-                          ldflags, install_dir)
+        session.add_pipeline_go_build(packages, output, modroot, prefix,
+                                      ldflags, install_dir)
     except MissingMelangeHeader:
         logging.error("No melange header is initialized")
         return "Error: Must first add a melange header."
+    except InvalidMelangeModel as e:
+        return _invalid_model(e)
+    return "Success"
+
+
+def melange_apply_spec(session: MelangeSession, spec: Dict[str, Any]) -> str:
+    """
+    Defines and writes a whole melange YAML model in one call: the header,
+    the build-time dependencies and the pipeline. Any previous model is
+    replaced. All problems with the spec are returned together and nothing
+    is changed if there are any. Use the melange_add_* tools for small
+    fixes afterwards, then call melange_write_model again.
+    """
+    logging.info(f"Applying melange spec: {spec}")
+    try:
+        session.apply_spec(spec)
+    except InvalidMelangeSpec as e:
+        errors = e.args[0]
+        logging.error(f"Invalid melange spec: {errors}")
+        return "Error: The spec is invalid:\n" + "\n".join(errors)
+    logging.info(f"Success!")
     return "Success"
 
 
-def melange_write_model() -> str:
+class SpecTool(StructuredTool):
+    """
+    A tool whose args_schema is only sent to the LLM. The arguments are
+    passed on unparsed as spec, so the tool can report every problem with
+    them instead of failing on the first pydantic error.
+    """
+    def _parse_input(self, tool_input: Union[str, Dict]) -> Dict[str, Any]:
+        if not isinstance(tool_input, dict):
+            return {"spec": {}}
+        return {"spec": tool_input}
+
+
+def apply_spec_tool(session: MelangeSession) -> BaseTool:
+    """
+    The melange_apply_spec tool of a session, with MelangeSpec as its schema
+    """
+    func = bind_session(melange_apply_spec, session)
+    return SpecTool(name=func.__name__, func=func, args_schema=MelangeSpec,
+                    description=inspect.cleandoc(func.__doc__))
+
+
+def melange_write_model(session: MelangeSession) -> str:
     """
     This function writes the Melange YAML model.
     Call this function after initializing the model with a header
@@ -135,10 +209,12 @@ def melange_write_model() -> str:
     """
     logging.info(f"Done constructing YAML. Writing to file...")
     try:
-        write_model()
+        session.write_model()
     except MissingMelangeHeader:
         logging.error("No melange header is initialized")
         return "Error: Must first add a melange header."
+    except InvalidMelangeModel as e:
+        return _invalid_model(e)
     logging.info(f"Success!")
     return "Success"
     
\ No newline at end of file
@@ -3,4 +3,19 @@ class MissingMelangeHeader(Exception):
     Raised if a melange operation is executed before
     a header has been initialized.
     """
-    pass
\ No newline at end of file
+    pass
+
+class InvalidMelangeSpec(Exception):
+    """
+    Raised if a melange spec fails validation.
+    The list of all problems found is the first argument.
+    """
+    pass
+
+
+class InvalidMelangeModel(Exception):
+    """
+    Raised if a change would make a melange YAML invalid.
+    The list of problems found is the first argument.
+    """
+    pass
@@ -2,15 +2,32 @@
 Classes representing different aspects of a melange YAML
 """
 
-from typing import Dict
+from typing import Callable, Dict, List, Optional
 from abc import abstractmethod
+import re
 import yaml
+from .spdx import check_license
+from .exceptions import InvalidMelangeModel
+
+
+PACKAGE_NAME_RE = re.compile(r"^[a-z0-9][a-z0-9._+-]*$")
+REPOSITORY_RE = re.compile(r"^(https?://|ssh://|git://|git@)\S+$")
 
 
 class MelangePipeline:
     """
     Base class for pipeline stage classes
     """
+    name = None # The value of uses, or runs
+
+    def validate(self) -> List[str]:
+        """
+        Checks the fields of the pipeline stage.
+        Override this method in children.
+        @return: The problems found
+        """
+        return []
+
     @abstractmethod
     def as_dict(self) -> Dict:
         """
@@ -24,9 +41,16 @@ class RunsPipeline(MelangePipeline):
     """
     Represents a runs pipeline stage
     """
+    name = "runs"
+
     def __init__(self, command: str):
         self.command = command
-    
+
+    def validate(self) -> List[str]:
+        if not _is_set(self.command):
+            return ["runs: the command must not be empty"]
+        return []
+
     def as_dict(self) -> Dict:
         data = {
             "runs": self.command
@@ -39,12 +63,26 @@ class GitCheckoutPipeline(MelangePipeline):
     """
     Represents a git-checkout pipeline stage
     """
+    name = "git-checkout"
+
     def __init__(self, repository: str, branch: str=None,
                  tag: str=None):
         self.repository = repository
         self.branch = branch
         self.tag = tag
 
+    def validate(self) -> List[str]:
+        errors = []
+        if not _is_set(self.repository) or not REPOSITORY_RE.match(self.repository):
+            errors.append(f"git-checkout: repository must be a git url, got {self.repository!r}")
+        if self.branch is not None and self.tag is not None:
+            errors.append("git-checkout: set either branch or tag, not both")
+        for field in ("branch", "tag"):
+            value = getattr(self, field)
+            if value is not None and not _is_set(value):
+                errors.append(f"git-checkout: {field} must not be empty")
+        return errors
+
     def as_dict(self) -> Dict:
         data = {
             "uses": "git-checkout",
@@ -65,6 +103,8 @@ class GoBuildPipeline(MelangePipeline):
     """
     Represents a go/build pipeline stage
     """
+    name = "go/build"
+
     def __init__(self, packages: str, output: str,
                  modroot: str=None, prefix: str=None,
                  ldflags: str=None, install_dir: str=None):
@@ -74,6 +114,20 @@ class GoBuildPipeline(MelangePipeline):
         self.prefix = prefix
         self.ldflags = ldflags
         self.install_dir = install_dir
+
+    def validate(self) -> List[str]:
+        errors = []
+        if not _is_set(self.packages):
+            errors.append("go/build: packages must not be empty")
+        if not _is_set(self.output) or "/" in self.output:
+            errors.append(f"go/build: output must be a binary name without a path, "
+                          f"got {self.output!r}")
+        if self.modroot is not None and (not _is_set(self.modroot)
+                                         or self.modroot.startswith("/")):
+            errors.append("go/build: modroot must be a path relative to the checkout")
+        if self.ldflags is not None and self.ldflags.strip().startswith("-ldflags"):
+            errors.append("go/build: ldflags holds the flag values only, without -ldflags")
+        return errors
     
     def as_dict(self) -> Dict:
         data = {
@@ -96,6 +150,37 @@ class GoBuildPipeline(MelangePipeline):
         return data
 
 
+def _is_set(value: str) -> bool:
+    """
+    True if value is a non-empty string
+    """
+    return isinstance(value, str) and value.strip() != ""
+
+
+def validate_pipeline(pipelines: List[Optional[MelangePipeline]]) -> List[str]:
+    """
+    Checks every stage and the order of the stages
+    @param pipelines: The stages. None stands for a stage that could not
+                      be read, so the others keep their index.
+    @return: The problems found
+    """
+    errors = []
+    checked_out = False
+    for i, p in enumerate(pipelines):
+        if p is None:
+            continue
+        errors += [f"pipeline[{i}] {e}" for e in p.validate()]
+        if p.name == "git-checkout":
+            if checked_out:
+                errors.append(f"pipeline[{i}] git-checkout: only one "
+                              "git-checkout step is supported")
+            checked_out = True
+        elif p.name == "go/build" and not checked_out:
+            errors.append(f"pipeline[{i}] go/build: must come after a "
+                          "git-checkout step that fetches the source")
+    return errors
+
+
 class MelangeYaml:
     """
     Represents a melange YAML file
@@ -109,24 +194,95 @@ class MelangeYaml:
         self.build_deps = []
         self.pipelines = []
 
+    def validate(self, complete: bool=False) -> List[str]:
+        """
+        Checks the header, dependencies and pipeline. Cheap enough to
+        run on every change.
+        @param complete: Also require everything a finished YAML needs
+        @return: The problems found
+        """
+        errors = self.validate_header()
+        errors += self.validate_dependencies()
+        errors += validate_pipeline(self.pipelines)
+        if complete and len(self.pipelines) == 0:
+            errors.append("pipeline: must have at least one step")
+        return errors
+
+    def validate_header(self) -> List[str]:
+        """
+        Checks the package, version, description and license. Each
+        problem starts with the name of its field.
+        @return: The problems found
+        """
+        errors = []
+        if not _is_set(self.package) or not PACKAGE_NAME_RE.match(self.package):
+            errors.append(f"package: {self.package!r} must be lowercase letters, "
+                          "digits and . _ + -")
+        if not _is_set(self.version) or len(self.version.split()) != 1:
+            errors.append(f"version: {self.version!r} must be a single word")
+        if not _is_set(self.description):
+            errors.append("description: must not be empty")
+        license_error = check_license(self.license or "")
+        if license_error is not None:
+            errors.append(f"license: {license_error}")
+        return errors
+
+    def validate_dependencies(self) -> List[str]:
+        """
+        Checks that the build dependencies are single, distinct names
+        @return: The problems found
+        """
+        errors = []
+        seen = set()
+        for dep in self.build_deps:
+            if not _is_set(dep) or len(dep.split()) != 1:
+                errors.append(f"dependency {dep!r}: must be a single package name")
+            elif dep in seen:
+                errors.append(f"dependency {dep}: listed more than once")
+            seen.add(dep)
+        return errors
+
+    def _keep_if_valid(self, before: List[str], undo: Callable):
+        """
+        Undoes a change that introduced new problems
+        @param before: The problems found before the change
+        @param undo: Reverts the change
+        @raise InvalidMelangeModel: With the new problems
+        """
+        errors = [e for e in self.validate() if e not in before]
+        if len(errors) > 0:
+            undo()
+            raise InvalidMelangeModel(errors)
+
     def add_build_dependency(self, dep: str):
         """
         Adds a build dependency
+        @raise InvalidMelangeModel: If the dependency is invalid
         """
+        before = self.validate()
         self.build_deps.append(dep)
+        self._keep_if_valid(before, self.build_deps.pop)
 
     def add_pipeline(self, pipeline: MelangePipeline):
         """
         Adds a pipeline stage
+        @raise InvalidMelangeModel: If the stage is invalid or out of order
         """
+        before = self.validate()
         self.pipelines.append(pipeline)
+        self._keep_if_valid(before, self.pipelines.pop)
 
     def dump_yaml(self, f: any):
         """
         Compiles the object to a melange YAML file and
         dumps the result.
         @param f: The file object to dump to
+        @raise InvalidMelangeModel: If the model is invalid or incomplete
         """
+        errors = self.validate(complete=True)
+        if len(errors) > 0:
+            raise InvalidMelangeModel(errors)
+
         # header
         data = {
             "package": {
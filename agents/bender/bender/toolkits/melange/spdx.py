@@ -0,0 +1,125 @@
+"""
+Checks license fields against SPDX license identifiers and expressions.
+spdx.json is a copy of the ids in the SPDX license list.
+"""
+
+from typing import Dict, Optional, Set
+import os
+import re
+import json
+import logging
+import functools
+
+
+SPDX_LIST_PATH = os.path.join(os.path.dirname(__file__), "spdx.json")
+
+# Replacements of deprecated ids that are still commonly written
+DEPRECATED = {
+    "GPL-2.0": "GPL-2.0-only", "GPL-2.0+": "GPL-2.0-or-later",
+    "GPL-3.0": "GPL-3.0-only", "GPL-3.0+": "GPL-3.0-or-later",
+    "LGPL-2.1": "LGPL-2.1-only", "LGPL-2.1+": "LGPL-2.1-or-later",
+    "LGPL-3.0": "LGPL-3.0-only", "LGPL-3.0+": "LGPL-3.0-or-later",
+    "AGPL-3.0": "AGPL-3.0-only",
+}
+
+OPERATORS = {"AND", "OR", "WITH"}
+TOKEN_RE = re.compile(r"\(|\)|[^\s()]+")
+LICENSE_REF_RE = re.compile(r"^(DocumentRef-[A-Za-z0-9.-]+:)?LicenseRef-[A-Za-z0-9.-]+$")
+
+
+class SpdxList:
+    """
+    The license and exception ids of the SPDX license list
+    """
+    def __init__(self, path: str):
+        """
+        @param path: A JSON file in the format of the SPDX licenses.json
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.version = data["licenseListVersion"]
+        self.licenses: Set[str] = set()
+        self.deprecated: Set[str] = set()
+        for l in data["licenses"]:
+            if l["isDeprecatedLicenseId"]:
+                self.deprecated.add(l["licenseId"])
+            else:
+                self.licenses.add(l["licenseId"])
+        self.exceptions: Set[str] = {e["licenseExceptionId"] for e in data["exceptions"]}
+        # Misspelled ids are matched to current ids only
+        self.by_squashed: Dict[str, str] = {_squash(l): l for l in sorted(self.licenses)}
+
+
+@functools.lru_cache(maxsize=None)
+def spdx_list() -> SpdxList:
+    """
+    The SPDX license list shipped with bender
+    """
+    return SpdxList(SPDX_LIST_PATH)
+
+
+def _squash(name: str) -> str:
+    """
+    Lowercase without punctuation, so "Apache 2.0" matches "Apache-2.0"
+    """
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def check_license(expression: str) -> Optional[str]:
+    """
+    Checks that a license is an SPDX id or an expression of them,
+    e.g. "MIT" or "Apache-2.0 OR MIT"
+    @return: Why the license is invalid, or None if it is valid
+    """
+    spdx = spdx_list()
+    tokens = TOKEN_RE.findall(expression)
+    if len(tokens) == 0:
+        return "license must not be empty"
+    # Whole-expression typos such as "Apache License 2.0"
+    if expression not in spdx.licenses and \
+       not any(t in OPERATORS or t in "()" for t in tokens):
+        guess = spdx.by_squashed.get(_squash(expression.replace("License", "")))
+        if guess is not None and guess != expression:
+            return f"{expression!r} is not an SPDX id, use {guess}"
+
+    depth = 0
+    expect_id = True
+    after_with = False
+    for t in tokens:
+        if t == "(":
+            if not expect_id:
+                return f"unexpected ( in {expression!r}"
+            depth += 1
+        elif t == ")":
+            depth -= 1
+            if depth < 0 or expect_id:
+                return f"unbalanced parentheses in {expression!r}"
+        elif t in OPERATORS:
+            if expect_id:
+                return f"unexpected {t} in {expression!r}"
+            expect_id = True
+            after_with = t == "WITH"
+            continue
+        elif t.upper() in OPERATORS:
+            return f"operators must be upper case, use {t.upper()}"
+        elif not expect_id:
+            return f"missing AND or OR before {t} in {expression!r}"
+        elif after_with:
+            if t not in spdx.exceptions:
+                return f"{t} is not an SPDX license exception"
+        elif t in DEPRECATED:
+            return f"{t} is deprecated, use {DEPRECATED[t]}"
+        elif t.rstrip("+") in spdx.deprecated:
+            logging.warning(f"License {t} is a deprecated SPDX id")
+        elif t.rstrip("+") not in spdx.licenses and not LICENSE_REF_RE.match(t):
+            guess = spdx.by_squashed.get(_squash(t))
+            if guess is not None:
+                return f"{t} is not an SPDX id, use {guess}"
+            return (f"{t} is not an SPDX license id (list version {spdx.version}). "
+                    f"Use LicenseRef-<name> for licenses without an SPDX id")
+        if t != "(":
+            expect_id = False
+        after_with = False
+    if depth != 0 or expect_id:
+        return f"incomplete license expression {expression!r}"
+    return None
@@ -0,0 +1,201 @@
+"""
+The JSON schema of a whole melange YAML, as taken by melange_apply_spec.
+The models are sent to the LLM as the function schema and parse its calls.
+"""
+
+from typing import Any, Dict, List, Literal, Optional, Tuple, Union
+from langchain.pydantic_v1 import BaseModel, Extra, Field, ValidationError, constr
+from .model import (MelangeYaml, MelangePipeline, RunsPipeline,
+                    GitCheckoutPipeline, GoBuildPipeline, validate_pipeline)
+from .exceptions import InvalidMelangeSpec
+
+
+NonEmpty = constr(strip_whitespace=True, min_length=1)
+
+
+class SpecModel(BaseModel):
+    """
+    Base class of the spec models. Unknown fields are errors.
+    """
+    class Config:
+        extra = Extra.forbid
+
+
+class MelangeHeader(SpecModel):
+    """
+    The package metadata
+    """
+    package: NonEmpty = Field(description="The name of the package")
+    version: NonEmpty = Field(description="The version of the package")
+    description: NonEmpty = Field(description="A one sentence description of the package")
+    license: NonEmpty = Field(description="The package's license as an SPDX id or "
+                                          "expression, e.g. MIT")
+
+
+class RunsStep(SpecModel):
+    """
+    Runs shell commands
+    """
+    runs: NonEmpty = Field(description="Shell commands to run")
+
+    def to_pipeline(self) -> MelangePipeline:
+        return RunsPipeline(self.runs)
+
+
+class GitCheckoutWith(SpecModel):
+    """
+    The repository and the branch or tag to check out
+    """
+    repository: NonEmpty = Field(description="The git repository url")
+    branch: Optional[NonEmpty] = Field(description="The branch to checkout")
+    tag: Optional[NonEmpty] = Field(description="The tag to checkout")
+
+
+class GitCheckoutStep(SpecModel):
+    """
+    Checks out a git repository, usually the first step
+    """
+    uses: Literal["git-checkout"]
+    with_: GitCheckoutWith = Field(alias="with")
+
+    def to_pipeline(self) -> MelangePipeline:
+        return GitCheckoutPipeline(self.with_.repository, self.with_.branch,
+                                   self.with_.tag)
+
+
+class GoBuildWith(SpecModel):
+    """
+    The go packages to build and where to install them
+    """
+    packages: NonEmpty = Field(description="Space-separated packages to compile, "
+                                           "relative to modroot")
+    output: NonEmpty = Field(description="Name of the output binary")
+    modroot: Optional[NonEmpty] = Field(description="Directory of go.mod")
+    prefix: Optional[NonEmpty] = Field(description="Prefix to relocate binaries. "
+                                                   "Defaults to usr")
+    ldflags: Optional[NonEmpty] = Field(description="Values passed to -ldflags")
+    install_dir: Optional[NonEmpty] = Field(description="Directory binaries are "
+                                                        "installed to. Defaults to bin")
+
+
+class GoBuildStep(SpecModel):
+    """
+    Builds and installs a go project. Must come after git-checkout.
+    """
+    uses: Literal["go/build"]
+    with_: GoBuildWith = Field(alias="with")
+
+    def to_pipeline(self) -> MelangePipeline:
+        w = self.with_
+        return GoBuildPipeline(w.packages, w.output, modroot=w.modroot, prefix=w.prefix,
+                               ldflags=w.ldflags, install_dir=w.install_dir)
+
+
+class MelangeSpec(SpecModel):
+    """
+    A whole melange YAML
+    """
+    header: MelangeHeader
+    pipeline: List[Union[RunsStep, GitCheckoutStep, GoBuildStep]] = Field(
+        description="The build steps in order")
+    dependencies: List[NonEmpty] = Field(default_factory=list,
+                                         description="The names of build-time packages")
+
+
+# Pipeline step -> the model of the step. A runs step is {"runs": command},
+# the others {"uses": step, "with": {...}}.
+STEP_MODELS = {
+    "runs": RunsStep,
+    "git-checkout": GitCheckoutStep,
+    "go/build": GoBuildStep,
+}
+
+
+def _errors(e: ValidationError, where: str) -> List[str]:
+    """
+    Formats the errors of a pydantic model as where.field: message
+    """
+    return [".".join([where] + [str(l) for l in err["loc"]]) + ": " + err["msg"]
+            for err in e.errors()]
+
+
+def _parse_step(step: Any, where: str) -> Tuple[Optional[MelangePipeline], List[str]]:
+    """
+    Parses one pipeline step with the model of its kind, so that its errors
+    are not mixed with those of the other kinds
+    """
+    if not isinstance(step, dict):
+        return None, [f"{where}: must be an object"]
+    kind = "runs" if "runs" in step else step.get("uses")
+    if kind not in STEP_MODELS:
+        return None, [f"{where}: unsupported step {kind!r}, use one of "
+                      + ", ".join(STEP_MODELS)]
+    try:
+        return STEP_MODELS[kind].parse_obj(step).to_pipeline(), []
+    except ValidationError as e:
+        return None, _errors(e, f"{where} ({kind})")
+
+
+def _header_values(header: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """
+    The header fields that hold text, as strings. Numbers are read as
+    strings like pydantic does. Other values are left to the schema.
+    """
+    values = {}
+    for field in MelangeHeader.__fields__:
+        value = header.get(field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        values[field] = value if isinstance(value, str) else None
+    return values
+
+
+def build_model(spec: Dict[str, Any]) -> MelangeYaml:
+    """
+    Builds a melange YAML object from a spec. Schema errors and the
+    problems found by the checks of MelangeYaml are reported together,
+    so one bad field does not hide the others.
+    @raise InvalidMelangeSpec: With every problem found if the spec is invalid
+    """
+    errors = [f"{k}: unknown field" for k in sorted(set(spec) - set(MelangeSpec.__fields__))]
+    header = spec.get("header")
+    if not isinstance(header, dict):
+        errors.append("header: required, must be an object")
+        header = None
+    values = _header_values(header or {})
+    model = MelangeYaml(**values)
+    if header is not None:
+        checked = [e for e in model.validate_header()
+                   if values[e.split(":")[0]] is not None]
+        errors += checked
+        # Skip the schema errors of fields the model already explained
+        flagged = {"header." + e.split(":")[0] for e in checked}
+        try:
+            MelangeHeader.parse_obj(header)
+        except ValidationError as e:
+            errors += [err for err in _errors(e, "header")
+                       if err.split(":")[0] not in flagged]
+
+    dependencies = spec.get("dependencies") or []
+    if not isinstance(dependencies, list):
+        errors.append("dependencies: must be a list of package names")
+        dependencies = []
+    model.build_deps = list(dependencies)
+    errors += model.validate_dependencies()
+
+    pipeline = spec.get("pipeline")
+    if not isinstance(pipeline, list) or len(pipeline) == 0:
+        errors.append("pipeline: must be a non-empty list of steps")
+        pipeline = []
+    steps = []
+    for i, step in enumerate(pipeline):
+        pipe, step_errors = _parse_step(step, f"pipeline[{i}]")
+        steps.append(pipe)
+        errors += step_errors
+    # Steps that did not parse are None and keep the index of the others
+    errors += validate_pipeline(steps)
+
+    if len(errors) > 0:
+        raise InvalidMelangeSpec(errors)
+    model.pipelines = steps
+    return model
@@ -1,76 +1,159 @@
+"""
+Builds melange YAML models. Each model belongs to a session so that
+several agents can build models for different packages in one process.
+"""
+
+from typing import Any, Dict, Optional
+import io
+import uuid
+import threading
 from .model import (MelangeYaml, RunsPipeline,
                     GitCheckoutPipeline, GoBuildPipeline)
-from .exceptions import MissingMelangeHeader
+from .spec import build_model
+from .exceptions import MissingMelangeHeader, InvalidMelangeModel
 
 
-state = None # TODO: Implement without singleton
-
-
-def _check_state_exists() -> str:
-    """
-    Check that a melange YAML object has been initialized
-    """
-    if state is None:
-        raise MissingMelangeHeader()
-    return None
-
-
-def add_header(package: str, version: str, description: str,
-               license: str):
-    """
-    Initialize a melange YAML object
-    """
-    #TODO: Validate license
-    global state
-    state = MelangeYaml(package, version, description, license)
-
-
-def add_build_dependency(package: str):
+class MelangeSession:
     """
-    Adds a build dependency to the current melange YAML
+    The melange YAML under construction by one agent and where it is
+    written to. Tool calls may run on executor threads, so every
+    operation holds the session lock.
     """
-    _check_state_exists()
-    state.add_build_dependency(package)
-
-
-def add_pipeline_runs(command: str):
+    def __init__(self, session_id: str, output_path: str):
+        """
+        @param session_id: The key of the session in the registry
+        @param output_path: Where write_model writes the YAML
+        """
+        self.session_id = session_id
+        self.output_path = output_path
+        self.model: Optional[MelangeYaml] = None
+        self._lock = threading.Lock()
+
+    def _check_model_exists(self):
+        """
+        Check that a melange YAML object has been initialized
+        """
+        if self.model is None:
+            raise MissingMelangeHeader()
+
+    def add_header(self, package: str, version: str, description: str,
+                   license: str):
+        """
+        Initialize a melange YAML object
+        @raise InvalidMelangeModel: If the header is invalid
+        """
+        model = MelangeYaml(package, version, description, license)
+        errors = model.validate()
+        if len(errors) > 0:
+            raise InvalidMelangeModel(errors)
+        with self._lock:
+            self.model = model
+
+    def _write(self):
+        """
+        Writes the model to the output path. The YAML is compiled first
+        so an invalid model leaves an existing file untouched.
+        """
+        buf = io.StringIO()
+        self.model.dump_yaml(buf)
+        with open(self.output_path, "w", encoding="utf-8") as f:
+            f.write(buf.getvalue())
+
+    def add_build_dependency(self, package: str):
+        """
+        Adds a build dependency to the current melange YAML
+        """
+        with self._lock:
+            self._check_model_exists()
+            self.model.add_build_dependency(package)
+
+    def add_pipeline_runs(self, command: str):
+        """
+        Adds a runs pipeline stage to the current melange YAML
+        """
+        with self._lock:
+            self._check_model_exists()
+            self.model.add_pipeline(RunsPipeline(command))
+
+    def add_pipeline_git_checkout(self, repository: str, branch: str=None,
+                                  tag: str=None):
+        """
+        Adds a git-checkout pipeline stage to the current melange YAML
+        """
+        with self._lock:
+            self._check_model_exists()
+            pipe = GitCheckoutPipeline(repository, branch, tag)
+            self.model.add_pipeline(pipe)
+
+    def add_pipeline_go_build(self, packages: str, output: str,
+                              modroot: str=None, prefix: str=None,
+                              ldflags: str=None, install_dir: str=None):
+        """
+        Adds a go/build stage to the current melange YAML
+        """
+        with self._lock:
+            self._check_model_exists()
+            pipe = GoBuildPipeline(packages, output,
+                                   modroot=modroot,
+                                   prefix=prefix,
+                                   ldflags=ldflags,
+                                   install_dir=install_dir)
+            self.model.add_pipeline(pipe)
+
+    def apply_spec(self, spec: Dict[str, Any]):
+        """
+        Replaces the current melange YAML with one built from a spec and
+        writes it. Nothing changes if the spec is invalid.
+        """
+        model = build_model(spec)
+        with self._lock:
+            self.model = model
+            self._write()
+
+    def write_model(self):
+        """
+        Writes the current melange YAML to the session's output path
+        """
+        with self._lock:
+            self._check_model_exists()
+            self._write()
+
+
+_sessions: Dict[str, MelangeSession] = {}
+_sessions_lock = threading.Lock()
+
+
+def open_session(output_path: str, session_id: str=None) -> MelangeSession:
     """
-    Adds a runs pipeline stage to the current melange YAML
+    Returns the session with the given id, creating it if it does not exist
+    @param output_path: Where the session writes its YAML
+    @param session_id: Defaults to a new random id
     """
-    _check_state_exists()
-    state.add_pipeline(RunsPipeline(command))
-
-
-def add_pipeline_git_checkout(repository: str, branch: str=None,
-                              tag: str=None):
-    """
-    Adds a git-checkout pipeline stage to the current melange YAML
-    """
-    _check_state_exists()
-    pipe = GitCheckoutPipeline(repository, branch, tag)
-    state.add_pipeline(pipe)
-
-
-def add_pipeline_go_build(packages: str, output: str,
-                          modroot: str=None, prefix: str=None,
-                          ldflags: str=None, install_dir: str=None):
+    with _sessions_lock:
+        if session_id is None:
+            session_id = uuid.uuid4().hex
+        session = _sessions.get(session_id)
+        if session is None:
+            session = MelangeSession(session_id, output_path)
+            _sessions[session_id] = session
+        elif session.output_path != output_path:
+            raise ValueError(f"Melange session {session_id} already writes "
+                             f"to {session.output_path}")
+        return session
+
+
+def get_session(session_id: str) -> MelangeSession:
     """
-    Adds a go/build stage to the current melange YAML
+    Returns an open session
+    @raise KeyError: If no session has the id
     """
-    _check_state_exists()
-    pipe = GoBuildPipeline(packages, output,
-                           modroot=modroot,
-                           prefix=prefix,
-                           ldflags=ldflags,
-                           install_dir=install_dir)
-    state.add_pipeline(pipe)
+    with _sessions_lock:
+        return _sessions[session_id]
 
 
-def write_model():
+def close_session(session_id: str):
     """
-    Writes the current melange YAML to disk
+    Removes a session and its model from the registry
     """
-    _check_state_exists()
-    path = "tmp.yaml"
-    with open(path, "w", encoding="utf-8") as f:
-        state.dump_yaml(f)
\ No newline at end of file
+    with _sessions_lock:
+        _sessions.pop(session_id, None)
@@ -0,0 +1,187 @@
+"""
+Resource accounting for the subprocesses started by the toolkits. Each
+command is recorded with its wall time, user/sys CPU time, peak RSS and
+exit code in a per-run JSONL ledger.
+
+Ledger fields:
+    user, sys: CPU seconds of the command and the processes it waited for
+    max_rss_kb: Peak RSS of the command. Only known for commands reaped
+                with reap(), otherwise null. Linux also counts the memory
+                of the agent when it forked the command, so this is never
+                below the size of the agent.
+    children_max_rss_kb: High-water mark so far of the peak RSS of every
+                         command the agent has run. Not specific to this
+                         command.
+    isolated: True if user and sys were measured for this command alone.
+              False if they are deltas of counters shared by every
+              command, which can include commands that exited concurrently.
+"""
+
+from typing import Dict, List, Optional
+import os
+import json
+import time
+import resource
+import subprocess
+import threading
+import contextlib
+
+
+LEDGER_ENV = "BENDER_RESOURCE_LEDGER"
+MAX_COMMAND_CHARS = 500
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+class Measurement:
+    """
+    The resources used by one command. Callers set exit_code
+    (and timed_out) before the measurement ends.
+    """
+    def __init__(self, tool: str, command: str):
+        """
+        @param tool: The tool that ran the command, e.g. run_sh or git
+        @param command: The command line
+        """
+        self.tool = tool
+        self.command = command[:MAX_COMMAND_CHARS]
+        self.exit_code: Optional[int] = None
+        self.timed_out = False
+        self.start = time.time()
+        self.wall = 0.0
+        self.user = 0.0
+        self.sys = 0.0
+        self.max_rss_kb: Optional[int] = None
+        self.children_max_rss_kb: Optional[int] = None
+        self.isolated = False
+
+    def set_child_usage(self, usage: resource.struct_rusage):
+        """
+        Sets the usage of the command from the rusage of its process
+        returned by os.wait4
+        """
+        self.user = usage.ru_utime
+        self.sys = usage.ru_stime
+        self.max_rss_kb = usage.ru_maxrss
+        self.isolated = True
+
+    def as_dict(self) -> Dict:
+        """
+        The JSON serializable form of the measurement
+        """
+        return {"tool": self.tool, "command": self.command,
+                "exit_code": self.exit_code, "timed_out": self.timed_out,
+                "start": self.start, "wall": round(self.wall, 3),
+                "user": round(self.user, 3), "sys": round(self.sys, 3),
+                "max_rss_kb": self.max_rss_kb,
+                "children_max_rss_kb": self.children_max_rss_kb,
+                "isolated": self.isolated}
+
+
+def _proc_times(pid: int) -> Optional[List[float]]:
+    """
+    The user and sys CPU time of a process and the children it has
+    waited for, read from /proc. None if the process is gone.
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "r", encoding="utf-8") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    # utime, stime, cutime and cstime are fields 14-17 of stat
+    utime, stime, cutime, cstime = (int(x) / CLOCK_TICKS for x in fields[11:15])
+    return [utime + cutime, stime + cstime]
+
+
+class ResourceLedger:
+    """
+    Appends measurements to a JSONL file. Without a file the
+    measurements are only kept in memory.
+    """
+    def __init__(self, path: str=None):
+        """
+        @param path: The JSONL file to append to
+        """
+        self._lock = threading.Lock()
+        self.path = path
+        self.records: List[Dict] = []
+
+    def open(self, path: str):
+        """
+        Starts writing to a file. Measurements taken so far are written too.
+        """
+        with self._lock:
+            self.path = path
+            with open(path, "a", encoding="utf-8") as f:
+                for r in self.records:
+                    f.write(json.dumps(r) + "\n")
+
+    def record(self, m: Measurement):
+        """
+        Stores a finished measurement
+        """
+        record = m.as_dict()
+        with self._lock:
+            self.records.append(record)
+            if self.path is not None:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+
+    @contextlib.contextmanager
+    def measure(self, tool: str, command: str, pid: int=None):
+        """
+        Measures the subprocesses run inside the block. A process reaped
+        with reap() is measured on its own. Otherwise the CPU time is the
+        change in the RUSAGE_CHILDREN counters of this process, which
+        only include children that have exited and been waited for, by
+        this block or by any other thread. Commands run by a long-lived
+        process (a shell session) are measured through /proc/<pid>.
+        @param pid: The long-lived process that runs the command
+        """
+        m = Measurement(tool, command)
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        proc_before = _proc_times(pid) if pid is not None else None
+        start = time.monotonic()
+        try:
+            yield m
+        finally:
+            m.wall = time.monotonic() - start
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            m.children_max_rss_kb = after.ru_maxrss
+            proc_after = _proc_times(pid) if pid is not None else None
+            if m.isolated:
+                pass # Set by reap()
+            elif proc_before is not None and proc_after is not None:
+                # The session shell is never reaped while it runs commands
+                m.user = proc_after[0] - proc_before[0]
+                m.sys = proc_after[1] - proc_before[1]
+                m.isolated = True
+            else:
+                m.user = after.ru_utime - before.ru_utime
+                m.sys = after.ru_stime - before.ru_stime
+            self.record(m)
+
+
+def reap(p: subprocess.Popen, m: Measurement, block: bool=True) -> Optional[int]:
+    """
+    Waits for a process with os.wait4 so that its own resource usage,
+    including the processes it waited for, is recorded in a measurement.
+    Use instead of p.wait() and p.poll().
+    @param block: Wait for the process to exit
+    @return: The exit code, or None if block is False and the process
+             is still running
+    """
+    if p.returncode is not None:
+        return p.returncode
+    try:
+        pid, status, usage = os.wait4(p.pid, 0 if block else os.WNOHANG)
+    except ChildProcessError:
+        return p.wait() # Already reaped elsewhere
+    if pid == 0:
+        return None
+    p.returncode = os.waitstatus_to_exitcode(status)
+    m.set_child_usage(usage)
+    return p.returncode
+
+
+# The measurements of the current run
+ledger = ResourceLedger(os.environ.get(LEDGER_ENV))
@@ -3,22 +3,58 @@ A collection of tools for interacting with a system
 """
 
 import logging
-from .tools import run_sh, list_dir
+from .tools import run_sh, shell, restart_shell, checkpoint, rollback, list_dir
+from .tree import tree
+from .exceptions import CheckpointNotFound, RollbackError
 
 
-def system_run_sh(command: str) -> str:
+def system_run_sh(command: str, timeout: int=None) -> str:
     """
     Run a shell command in the current working directory. Shell
     commands should be safe and not harmful to the system. All commands
     must be approved by the user. If the user rejects a command, an error
-    is returned. The contents of stdout and stderr are written to a file
-    which can be examined for helpful logs and errors. The name of this file
-    is returned. Note that all commands are run independently in subshells.
+    is returned. Returns the exit code and duration of the command followed
+    by the beginning and end of stdout and stderr. The full output is written
+    to a file whose name is returned and which can be examined for helpful
+    logs and errors. Commands are killed after timeout seconds (15 minutes by
+    default). Note that all commands are run independently in subshells.
     Therefore, any environmental variables you create will not persist in the
     next call to run_sh. Chain your shell commands using &&, |, >, ect accordingly.
+    Use system_shell instead when iterating on a build.
     """
     logging.info(f"Executing: {command}")
-    return run_sh(command)
+    summary = run_sh(command, timeout=timeout)
+    logging.info(summary.split("\n", 1)[0])
+    return summary
+
+
+def system_shell(command: str, timeout: int=None) -> str:
+    """
+    Run a shell command in a persistent bash session. Unlike system_run_sh,
+    the working directory, environment variables and shell functions are kept
+    between calls, so set up the environment once (e.g. cd repo && export
+    CGO_ENABLED=0) and then run build commands one at a time. Shell commands
+    should be safe and not harmful to the system. Returns the exit code and
+    duration of the command followed by the beginning and end of stdout and
+    stderr. The full output is written to a file whose name is returned.
+    Commands are killed after timeout seconds (15 minutes by default). A
+    command that times out or exits the shell restarts the session.
+    """
+    logging.info(f"Executing in shell session: {command}")
+    summary = shell(command, timeout=timeout)
+    logging.info(summary.split("\n", 1)[0])
+    return summary
+
+
+def system_shell_restart() -> str:
+    """
+    Restarts the persistent bash session used by system_shell. Use this
+    if the session is stuck or its environment is broken. The working
+    directory and environment variables are reset.
+    """
+    logging.info("Restarting shell session")
+    restart_shell()
+    return "Success"
 
 
 def system_list_dir(path: str) -> str:
@@ -34,3 +70,70 @@ def system_list_dir(path: str) -> str:
     except FileNotFoundError:
         logging.error(f"Path not found. {path} does not exist.")
         return "Error: Path not found"
+    return contents
+
+
+def system_tree(path: str, max_depth: int=3, include_vendor: bool=False,
+                include_tests: bool=False) -> str:
+    """
+    Returns the layout of the directory at the provided path as an indented
+    tree of subdirectories and files with their sizes, down to max_depth
+    levels. Files ignored by .gitignore are hidden. Vendored directories
+    (node_modules, vendor, ...) and test directories and files are collapsed
+    into a single line with a file count unless include_vendor or
+    include_tests is set. Large trees are shortened to fit the response.
+    Use this to explore a GitHub repo in one call before reading files.
+    If the provided path is not found, an error is returned.
+    """
+    logging.info(f"Listing the tree of {path}...")
+    try:
+        text = tree(path, max_depth=max_depth, include_vendor=include_vendor,
+                    include_tests=include_tests)
+    except FileNotFoundError:
+        logging.error(f"Path not found. {path} does not exist.")
+        return "Error: Path not found"
+    logging.info(text)
+    return text
+
+
+def system_checkpoint(path: str) -> str:
+    """
+    Saves the current state of a directory, usually a cloned repository,
+    so it can be restored with system_rollback. Checkpoints take
+    milliseconds, so create one before running a build command that may
+    fail or modify the source tree. Returns the checkpoint number.
+    If the provided path is not found, an error is returned.
+    """
+    logging.info(f"Creating a checkpoint of {path}...")
+    try:
+        result = checkpoint(path)
+    except FileNotFoundError:
+        logging.error(f"Path not found. {path} does not exist.")
+        return "Error: Path not found"
+    except RollbackError as e:
+        logging.error(f"Could not create a checkpoint: {str(e)}")
+        return "Error: " + str(e)
+    logging.info(result)
+    return result
+
+
+def system_rollback(path: str, checkpoint: int=None) -> str:
+    """
+    Restores a directory to a checkpoint created with system_checkpoint,
+    undoing every change made since, including files created by a failed
+    build. Much faster than cloning the repository again. Restores the
+    latest checkpoint unless a checkpoint number is provided. Later
+    checkpoints are discarded. Files ignored by .gitignore are kept.
+    If the path or checkpoint is not found, an error is returned.
+    """
+    logging.info(f"Rolling {path} back to checkpoint {checkpoint or 'latest'}...")
+    try:
+        result = rollback(path, checkpoint)
+    except FileNotFoundError:
+        logging.error(f"Path not found. {path} does not exist.")
+        return "Error: Path not found"
+    except (CheckpointNotFound, RollbackError) as e:
+        logging.error(f"Could not roll back: {str(e)}")
+        return "Error: " + str(e)
+    logging.info(result)
+    return result
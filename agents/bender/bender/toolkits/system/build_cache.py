@@ -0,0 +1,316 @@
+"""
+A managed root for the caches of build tools (go, pip, cargo, npm, ...).
+Every command the agent runs points the tools at directories under the
+cache root so repeat builds reuse downloaded modules and compiled objects.
+The root is bounded in size by pruning the least recently used entries.
+"""
+
+from typing import Dict, Iterator, List, Set, Tuple
+import os
+import glob
+import time
+import fcntl
+import shutil
+import logging
+from ..cache import cache_dir
+
+
+# Env var -> directory under the build cache root
+BUILD_CACHE_VARS = {
+    "GOCACHE": "go/build",
+    "GOMODCACHE": "go/mod",
+    "PIP_CACHE_DIR": "pip",
+    "CARGO_HOME": "cargo",
+    "npm_config_cache": "npm",
+    "YARN_CACHE_FOLDER": "yarn",
+    "GRADLE_USER_HOME": "gradle",
+    "CCACHE_DIR": "ccache",
+}
+# Files that configure a tool rather than cache for it. They are copied
+# from the user's default home of the tool when its home is redirected.
+# Env var -> (default home, file or directory names)
+TOOL_CONFIG = {
+    "CARGO_HOME": ("~/.cargo", ["config.toml", "config",
+                                "credentials.toml", "credentials"]),
+    "GRADLE_USER_HOME": ("~/.gradle", ["gradle.properties", "init.d"]),
+}
+
+# What a cache entry is for each cache, i.e. what is pruned as a whole.
+# "file" is for content-addressed caches where every file stands alone.
+# "gomod" is the layout of the go module cache. Otherwise the entries are
+# the paths matching the glob patterns. Patterns with ** match files only.
+# Paths that are not part of an entry are never pruned.
+EVICTION_UNITS = {
+    "go/build": "file",
+    "ccache": "file",
+    "go/mod": "gomod",
+    "pip": ["wheels/**/*.whl", "http/**/*", "http-v2/**/*"],
+    "cargo": ["registry/cache/*/*", "registry/src/*/*", "registry/index/*",
+              "git/db/*", "git/checkouts/*/*"],
+    "npm": ["_cacache/content-v2/**/*", "_cacache/index-v5/**/*"],
+    "yarn": ["v*/*"],
+    "gradle": ["caches/modules-2/files-2.1/*/*/*", "caches/transforms-*/*",
+               "caches/jars-*/*", "wrapper/dists/*/*"],
+}
+GOMOD_DOWNLOAD_EXTS = (".zip", ".mod", ".info", ".ziphash", ".lock")
+
+MAX_BYTES_ENV = "BENDER_BUILD_CACHE_MAX_BYTES"
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+PRUNE_GRACE_PERIOD = 60 * 60 # Files used this recently are never pruned
+PRUNE_LOCK = ".prune.lock"
+
+_configured: Set[str] = set() # Redirected homes whose config was copied
+
+
+def build_cache_root() -> str:
+    """
+    The root of the build caches, under the bender cache root
+    """
+    return cache_dir("build")
+
+
+def build_env(base: Dict[str, str]=None) -> Dict[str, str]:
+    """
+    An environment with the build tool caches pointed at the cache root.
+    Variables that are already set are left alone.
+    @param base: The environment to extend. Defaults to os.environ
+    """
+    env = dict(os.environ if base is None else base)
+    root = build_cache_root()
+    for var, subdir in BUILD_CACHE_VARS.items():
+        if var not in env:
+            path = os.path.join(root, subdir)
+            os.makedirs(path, exist_ok=True)
+            env[var] = path
+            if var in TOOL_CONFIG and path not in _configured:
+                _copy_config(var, path)
+                _configured.add(path)
+    return env
+
+
+def _copy_config(var: str, home: str):
+    """
+    Copies the config and credentials of a tool from its default home
+    into the redirected one so they are not silently dropped. Files that
+    already exist in the redirected home are kept.
+    """
+    default_home, names = TOOL_CONFIG[var]
+    default_home = os.path.expanduser(default_home)
+    for name in names:
+        src = os.path.join(default_home, name)
+        dst = os.path.join(home, name)
+        if os.path.lexists(dst):
+            continue
+        try:
+            if os.path.isdir(src):
+                shutil.copytree(src, dst)
+            elif os.path.isfile(src):
+                shutil.copy2(src, dst)
+        except OSError as e:
+            logging.warning(f"Could not copy {src} to the build cache: {e}")
+
+
+def _scan(root: str, since: float=None) -> Tuple[int, int, int, int]:
+    """
+    Walks the cache.
+    @param since: Files modified after this time count as new and files
+                  only accessed after it count as reused
+    @return: Total bytes, total files, new bytes and reused bytes
+    """
+    total = nfiles = new = reused = 0
+    for dirpath, _, files in os.walk(root):
+        for f in files:
+            try:
+                st = os.lstat(os.path.join(dirpath, f))
+            except OSError:
+                continue
+            total += st.st_size
+            nfiles += 1
+            if since is None:
+                continue
+            if st.st_mtime >= since:
+                new += st.st_size
+            elif st.st_atime >= since:
+                reused += st.st_size
+    return total, nfiles, new, reused
+
+
+def _format_bytes(n: int) -> str:
+    """
+    A human readable size
+    """
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n} B"
+        n /= 1024
+
+
+class BuildCacheUsage:
+    """
+    Measures how much of the build cache a run reused and how much it added
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.start_bytes = 0
+
+    def begin(self):
+        """
+        Records the state of the cache at the start of a run
+        """
+        self.start = time.time()
+        self.start_bytes = _scan(build_cache_root())[0]
+
+    def report(self) -> str:
+        """
+        A summary of the cache effectiveness of the run. Reuse is measured
+        through access times, so it is a lower bound on relatime mounts.
+        """
+        total, nfiles, new, reused = _scan(build_cache_root(), since=self.start)
+        lines = ["Build cache:",
+                 f"\tSize at start: {_format_bytes(self.start_bytes)}",
+                 f"\tSize at end: {_format_bytes(total)} in {nfiles} files",
+                 f"\tWritten this run: {_format_bytes(new)}",
+                 f"\tReused this run: {_format_bytes(reused)}"]
+        if new + reused > 0:
+            lines.append(f"\tHit ratio: {reused / (new + reused):.0%}")
+        return "\n".join(lines)
+
+
+def _gomod_units(root: str) -> Iterator[List[str]]:
+    """
+    The entries of a go module cache: every module@version directory, the
+    download files of each module version and each vcs checkout
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel = os.path.relpath(dirpath, root)
+        if rel == os.path.join("cache", "vcs"):
+            for d in dirnames:
+                yield [os.path.join(dirpath, d)]
+            dirnames.clear()
+            continue
+        if os.path.basename(dirpath) == "@v":
+            versions = {}
+            for f in filenames:
+                version, ext = os.path.splitext(f)
+                if ext in GOMOD_DOWNLOAD_EXTS:
+                    versions.setdefault(version, []).append(os.path.join(dirpath, f))
+            yield from versions.values()
+            continue
+        if rel.split(os.sep)[0] == "cache":
+            continue
+        for d in [d for d in dirnames if "@" in d]:
+            yield [os.path.join(dirpath, d)]
+            dirnames.remove(d) # Removed as a whole, no need to descend
+
+
+def _units(path: str, layout) -> Iterator[List[str]]:
+    """
+    The entries of one cache. An entry is a list of paths removed together.
+    """
+    if layout == "file":
+        for dirpath, _, filenames in os.walk(path):
+            for f in filenames:
+                yield [os.path.join(dirpath, f)]
+    elif layout == "gomod":
+        yield from _gomod_units(path)
+    else:
+        seen = set()
+        for pattern in layout:
+            recursive = "**" in pattern
+            for p in glob.glob(os.path.join(path, pattern), recursive=recursive):
+                if recursive and not os.path.isfile(p):
+                    continue
+                if p not in seen:
+                    seen.add(p)
+                    yield [p]
+
+
+def _usage(paths: List[str]) -> Tuple[float, int]:
+    """
+    When an entry was last used and how large it is
+    """
+    used = 0.0
+    size = 0
+    for path in paths:
+        if os.path.isdir(path) and not os.path.islink(path):
+            files = [os.path.join(d, f) for d, _, fs in os.walk(path) for f in fs]
+        else:
+            files = [path]
+        for f in files:
+            try:
+                st = os.lstat(f)
+            except OSError:
+                continue
+            used = max(used, st.st_atime, st.st_mtime)
+            size += st.st_size
+    return used, size
+
+
+def _make_writable(func, path: str, _):
+    """
+    rmtree error handler. Go makes its module cache read-only, so the
+    parent directory is made writable and the removal retried.
+    """
+    os.chmod(os.path.dirname(path), 0o755)
+    func(path)
+
+
+def _remove(path: str):
+    """
+    Deletes a file or a whole directory tree
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        for dirpath, dirnames, _ in os.walk(path):
+            for d in dirnames:
+                os.chmod(os.path.join(dirpath, d), 0o755)
+        shutil.rmtree(path, onerror=_make_writable)
+    else:
+        try:
+            os.remove(path)
+        except PermissionError:
+            os.chmod(os.path.dirname(path), 0o755)
+            os.remove(path)
+
+
+def prune(max_bytes: int=None) -> int:
+    """
+    Deletes the least recently used cache entries until the build cache
+    fits in max_bytes. Entries such as a go module@version directory are
+    deleted as a whole so tools never see a partial one. Only one process
+    prunes at a time.
+    @param max_bytes: Defaults to the BENDER_BUILD_CACHE_MAX_BYTES env var
+    @return: The number of bytes freed
+    """
+    if max_bytes is None:
+        max_bytes = int(os.environ.get(MAX_BYTES_ENV, DEFAULT_MAX_BYTES))
+    root = build_cache_root()
+    with open(os.path.join(root, PRUNE_LOCK), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 0 # Another run is pruning
+        total = _scan(root)[0]
+        if total <= max_bytes:
+            return 0
+        entries = []
+        for subdir, layout in EVICTION_UNITS.items():
+            for paths in _units(os.path.join(root, subdir), layout):
+                used, size = _usage(paths)
+                entries.append((used, size, paths))
+        freed = 0
+        cutoff = time.time() - PRUNE_GRACE_PERIOD
+        for used, size, paths in sorted(entries, key=lambda e: e[0]):
+            if total - freed <= max_bytes or used > cutoff:
+                break
+            try:
+                for path in paths:
+                    _remove(path)
+            except OSError as e:
+                logging.warning(f"Could not prune {paths[0]}: {e}")
+                continue
+            freed += size
+        return freed
+
+
+# The cache usage of the current run
+usage = BuildCacheUsage()
@@ -0,0 +1,12 @@
+class CheckpointNotFound(Exception):
+    """
+    Raised when rolling back to a checkpoint that does not exist
+    """
+    pass
+
+
+class RollbackError(Exception):
+    """
+    Raised when a workspace cannot be restored from a checkpoint
+    """
+    pass
@@ -0,0 +1,231 @@
+"""
+An asyncio based executor for shell commands. The full output of a
+command is streamed to its own file while only the head and tail are
+kept in memory. Commands that run past their timeout are killed along
+with every process they started.
+"""
+
+from typing import Dict, Tuple
+import os
+import time
+import signal
+import asyncio
+import tempfile
+from ..resources import ledger
+
+
+TIMEOUT_ENV = "BENDER_CMD_TIMEOUT"
+DEFAULT_TIMEOUT = 15 * 60 # Seconds
+KILL_GRACE_PERIOD = 5 # Seconds between SIGTERM and SIGKILL
+DRAIN_TIMEOUT = 1 # Seconds to read remaining output after an exit
+READ_SIZE = 64 * 1024
+HEAD_BYTES = 4 * 1024
+TAIL_BYTES = 8 * 1024
+OUTPUT_PREFIX = "cmd_out_"
+
+
+def default_timeout() -> float:
+    """
+    The command timeout. Can be overridden with the BENDER_CMD_TIMEOUT env var.
+    """
+    return float(os.environ.get(TIMEOUT_ENV, DEFAULT_TIMEOUT))
+
+
+class HeadTailBuffer:
+    """
+    Keeps the first head_bytes and the last tail_bytes written to it.
+    Memory use is bounded no matter how much is written.
+    """
+    def __init__(self, head_bytes: int=HEAD_BYTES, tail_bytes: int=TAIL_BYTES):
+        """
+        @param head_bytes: The number of leading bytes kept
+        @param tail_bytes: The number of trailing bytes kept
+        """
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.nbytes = 0
+
+    def write(self, data: bytes):
+        """
+        Appends data, dropping the middle once head and tail are full
+        """
+        self.nbytes += len(data)
+        room = self.head_bytes - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data
+            if len(self.tail) > self.tail_bytes:
+                del self.tail[:len(self.tail) - self.tail_bytes]
+
+    @property
+    def ndropped(self) -> int:
+        """
+        The number of bytes between the head and the tail that were dropped
+        """
+        return self.nbytes - len(self.head) - len(self.tail)
+
+    def getvalue(self) -> str:
+        """
+        The head and tail joined by a marker if anything was dropped
+        """
+        head = self.head.decode("utf-8", errors="replace")
+        tail = self.tail.decode("utf-8", errors="replace")
+        if self.ndropped == 0:
+            return head + tail
+        return f"{head}\n... [{self.ndropped} bytes omitted] ...\n{tail}"
+
+
+class CommandResult:
+    """
+    The outcome of a shell command
+    """
+    def __init__(self, command: str, exit_code: int, duration: float,
+                 timed_out: bool, output: str, output_path: str, nbytes: int):
+        """
+        @param exit_code: The exit code. Negative if killed by a signal
+        @param duration: Wall time in seconds
+        @param timed_out: True if the command was killed for running too long
+        @param output: The head and tail of stdout and stderr
+        @param output_path: The file holding the full output
+        @param nbytes: The size of the full output
+        """
+        self.command = command
+        self.exit_code = exit_code
+        self.duration = duration
+        self.timed_out = timed_out
+        self.output = output
+        self.output_path = output_path
+        self.nbytes = nbytes
+
+    def as_dict(self) -> Dict:
+        """
+        The JSON serializable form of the result without the output
+        """
+        return {"command": self.command, "exit_code": self.exit_code,
+                "duration": self.duration, "timed_out": self.timed_out,
+                "output_path": self.output_path, "nbytes": self.nbytes}
+
+    def summary(self) -> str:
+        """
+        A short report for the agent
+        """
+        status = f"timed out after {self.duration:.1f}s" if self.timed_out else \
+                 f"exit code {self.exit_code} after {self.duration:.1f}s"
+        return f"Command {status}. Full output ({self.nbytes} bytes) " \
+               f"written to {self.output_path}\n{self.output}"
+
+
+def new_output_path(directory: str=".") -> str:
+    """
+    A new, unique file for the output of a command
+    """
+    fd, path = tempfile.mkstemp(prefix=OUTPUT_PREFIX, suffix=".txt", dir=directory)
+    os.close(fd)
+    return os.path.relpath(path)
+
+
+def kill_group(pgid: int, sig: int):
+    """
+    Signals every process of a process group
+    """
+    try:
+        os.killpg(pgid, sig)
+    except ProcessLookupError:
+        pass
+
+
+async def _open_pipe():
+    """
+    A pipe whose read end is an asyncio stream. The output is not
+    read through the subprocess transport because that only reports
+    an exit once every process holding the pipe has closed it.
+    @return: The reader, its transport and the write file descriptor
+    """
+    rfd, wfd = os.pipe()
+    reader = asyncio.StreamReader()
+    transport, _ = await asyncio.get_running_loop().connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(rfd, "rb", 0))
+    return reader, transport, wfd
+
+
+async def _wait_or_kill(p: asyncio.subprocess.Process, timeout: float) -> Tuple[int, bool]:
+    """
+    Waits for a process to exit. On timeout its whole process group
+    is sent SIGTERM and then SIGKILL after KILL_GRACE_PERIOD.
+    @return: The exit code and whether the process timed out
+    """
+    try:
+        return await asyncio.wait_for(p.wait(), timeout), False
+    except asyncio.TimeoutError:
+        pass
+    kill_group(p.pid, signal.SIGTERM)
+    try:
+        return await asyncio.wait_for(p.wait(), KILL_GRACE_PERIOD), True
+    except asyncio.TimeoutError:
+        kill_group(p.pid, signal.SIGKILL)
+        return await p.wait(), True
+
+
+async def run_command(command: str, timeout: float=None, output_path: str=None,
+                      cwd: str=None, env: Dict[str, str]=None) -> CommandResult:
+    """
+    Runs a shell command in its own process group, streaming stdout and
+    stderr to output_path. Processes the command leaves running in the
+    background are killed once it exits.
+    """
+    if timeout is None:
+        timeout = default_timeout()
+    if output_path is None:
+        output_path = new_output_path()
+    buffer = HeadTailBuffer()
+    reader, transport, wfd = await _open_pipe()
+    start = time.monotonic()
+    try:
+        p = await asyncio.create_subprocess_shell(
+            command, stdin=asyncio.subprocess.DEVNULL, stdout=wfd, stderr=wfd,
+            cwd=cwd, env=env, start_new_session=True) # TODO: shell=True is dangerous
+    finally:
+        os.close(wfd)
+
+    async def _stream():
+        with open(output_path, "wb") as f:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                f.write(data)
+                buffer.write(data)
+
+    stream = asyncio.ensure_future(_stream())
+    try:
+        exit_code, timed_out = await _wait_or_kill(p, timeout)
+        duration = time.monotonic() - start
+        try:
+            await asyncio.wait_for(asyncio.shield(stream), DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            kill_group(p.pid, signal.SIGKILL) # Background processes hold the pipe
+            try:
+                await asyncio.wait_for(stream, DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        transport.close()
+    return CommandResult(command, exit_code, duration, timed_out,
+                         buffer.getvalue(), output_path, buffer.nbytes)
+
+
+def execute(command: str, timeout: float=None, cwd: str=None,
+            env: Dict[str, str]=None) -> CommandResult:
+    """
+    Synchronous wrapper around run_command. The resources used by the
+    command are recorded in the resource ledger.
+    """
+    with ledger.measure("run_sh", command) as m:
+        result = asyncio.run(run_command(command, timeout=timeout, cwd=cwd, env=env))
+        m.exit_code = result.exit_code
+        m.timed_out = result.timed_out
+    return result
@@ -0,0 +1,192 @@
+"""
+A long-lived bash process that keeps its working directory, environment
+variables and shell functions between commands. The end of each command
+is found through a unique sentinel line printed after it.
+"""
+
+from typing import Dict, Optional
+import os
+import re
+import time
+import atexit
+import uuid
+import shlex
+import signal
+import select
+import contextlib
+import subprocess
+from .executor import (CommandResult, HeadTailBuffer, default_timeout,
+                       new_output_path, kill_group, KILL_GRACE_PERIOD, READ_SIZE)
+from .build_cache import build_env
+from ..resources import ledger
+
+
+DEFAULT_SESSION = "default"
+SHELL = ["bash", "--noprofile", "--norc"]
+SENTINEL_PREFIX = "__BENDER_DONE_"
+
+
+class ShellExited(Exception):
+    """
+    Raised when the shell process exits in the middle of a command
+    """
+    pass
+
+
+class ShellSession:
+    """
+    A persistent shell. Commands run one at a time in the same bash process.
+    A session is restarted when a command times out or exits the shell.
+    """
+    def __init__(self, cwd: str=None, env: Dict[str, str]=None):
+        """
+        @param cwd: The starting directory. Defaults to the current directory
+        @param env: The starting environment. Defaults to os.environ
+        """
+        self.cwd = cwd
+        self.env = env
+        self.p: Optional[subprocess.Popen] = None
+        self.ncommands = 0
+
+    @property
+    def alive(self) -> bool:
+        """
+        True if the shell process is running
+        """
+        return self.p is not None and self.p.poll() is None
+
+    def start(self):
+        """
+        Starts the shell process in its own process group
+        """
+        self.p = subprocess.Popen(SHELL, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                  stderr=subprocess.STDOUT, cwd=self.cwd, env=self.env,
+                                  start_new_session=True)
+
+    def close(self) -> Optional[int]:
+        """
+        Kills the shell and every process it started
+        @return: The exit code of the shell
+        """
+        if self.p is None:
+            return None
+        kill_group(self.p.pid, signal.SIGTERM)
+        try:
+            self.p.wait(KILL_GRACE_PERIOD)
+        except subprocess.TimeoutExpired:
+            kill_group(self.p.pid, signal.SIGKILL)
+            self.p.wait()
+        with contextlib.suppress(BrokenPipeError):
+            self.p.stdin.close()
+        self.p.stdout.close()
+        returncode = self.p.returncode
+        self.p = None
+        return returncode
+
+    def restart(self):
+        """
+        Replaces the shell with a fresh one. The working directory and
+        environment are reset.
+        """
+        self.close()
+        self.start()
+
+    def _send(self, command: str, sentinel: str):
+        """
+        Writes a command followed by the sentinel. The command is quoted
+        and run through eval so that unbalanced quotes or an unterminated
+        heredoc fail on their own instead of swallowing the sentinel. eval
+        runs in the shell itself so cd and export persist. stdin is closed
+        so the command cannot read the rest of the protocol.
+        """
+        script = f"{{ eval {shlex.quote(command)}\n}} < /dev/null 2>&1\n" \
+                 f"printf '\\n{sentinel} %d\\n' $?\n"
+        self.p.stdin.write(script.encode("utf-8"))
+        self.p.stdin.flush()
+
+    def _read_until(self, sentinel: str, deadline: float, sink) -> int:
+        """
+        Streams output to sink until the sentinel line is read
+        @return: The exit code of the command
+        """
+        marker = ("\n" + sentinel + " ").encode("utf-8")
+        done = re.compile(re.escape(marker) + rb"(-?\d+)\n")
+        pending = bytearray()
+        fd = self.p.stdout.fileno()
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError()
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                continue
+            data = os.read(fd, READ_SIZE)
+            if not data:
+                sink(bytes(pending))
+                raise ShellExited()
+            pending += data
+            m = done.search(pending)
+            if m is not None:
+                sink(bytes(pending[:m.start()]))
+                return int(m.group(1))
+            # Hold back enough bytes to find a marker split across reads
+            keep = len(marker) + 16
+            if len(pending) > keep:
+                sink(bytes(pending[:-keep]))
+                del pending[:-keep]
+
+    def run(self, command: str, timeout: float=None) -> CommandResult:
+        """
+        Runs a command in the session. Output is streamed to a new
+        cmd_out_*.txt file and its head and tail are kept in memory.
+        """
+        if timeout is None:
+            timeout = default_timeout()
+        if not self.alive:
+            self.restart()
+        self.ncommands += 1
+        sentinel = SENTINEL_PREFIX + uuid.uuid4().hex
+        output_path = new_output_path()
+        buffer = HeadTailBuffer()
+        timed_out = False
+        start = time.monotonic()
+        with open(output_path, "wb") as f, \
+             ledger.measure("shell", command, pid=self.p.pid) as m:
+            def sink(data: bytes):
+                f.write(data)
+                buffer.write(data)
+            try:
+                self._send(command, sentinel)
+                exit_code = self._read_until(sentinel, start + timeout, sink)
+            except TimeoutError:
+                timed_out = True
+                exit_code = self.close()
+            except (ShellExited, BrokenPipeError):
+                self.p.wait()
+                exit_code = self.close()
+            m.exit_code = exit_code
+            m.timed_out = timed_out
+        return CommandResult(command, exit_code, time.monotonic() - start, timed_out,
+                             buffer.getvalue(), output_path, buffer.nbytes)
+
+
+_sessions: Dict[str, ShellSession] = {}
+
+
+def get_session(name: str=DEFAULT_SESSION) -> ShellSession:
+    """
+    The shell session registered under a name. Created on first use.
+    """
+    if name not in _sessions:
+        _sessions[name] = ShellSession(env=build_env())
+    return _sessions[name]
+
+
+@atexit.register
+def close_sessions():
+    """
+    Kills every session. Runs at exit so no shells outlive the agent.
+    """
+    for session in _sessions.values():
+        session.close()
+    _sessions.clear()
@@ -0,0 +1,268 @@
+"""
+Cheap checkpoints of a workspace directory that a failed build can be
+rolled back to. Depending on what the filesystem and the directory
+support, a checkpoint is one of:
+    reflink:  a copy-on-write clone of the tree (btrfs, xfs, ...)
+    git:      a tree object of the work tree written through a private index
+    hardlink: a tree of hard links plus the size and mtime of every file
+"""
+
+from typing import Dict, List, Optional, Tuple
+import os
+import shutil
+import atexit
+import subprocess
+from .exceptions import CheckpointNotFound, RollbackError
+
+
+SNAPSHOT_DIR = ".bender-snapshots" # Created next to the workspace
+CHECKPOINT_INDEX = "bender-checkpoint-index" # Inside the git dir
+ALWAYS_SKIPPED = {".git"}
+
+_reflink_support: Dict[int, bool] = {} # st_dev -> whether cp --reflink works
+
+
+def _git(args: List[str], cwd: str, env: Dict[str, str]=None) -> str:
+    """
+    Runs a git command and returns its stripped stdout
+    """
+    r = subprocess.run(["git"] + args, cwd=cwd, capture_output=True, text=True,
+                       env=None if env is None else dict(os.environ, **env))
+    if r.returncode != 0:
+        raise RollbackError(r.stderr.strip().replace("\n", ", "))
+    return r.stdout.strip()
+
+
+def _git_toplevel(path: str) -> Optional[str]:
+    """
+    The root of the git work tree at path, or None if path is not one
+    """
+    try:
+        return os.path.realpath(_git(["rev-parse", "--show-toplevel"], path))
+    except RollbackError:
+        return None
+
+
+def _reflink(src: str, dst: str) -> bool:
+    """
+    Copies a file or tree as a copy-on-write clone
+    @return: False if the filesystem does not support reflinks
+    """
+    r = subprocess.run(["cp", "-a", "--reflink=always", src, dst],
+                       capture_output=True)
+    return r.returncode == 0
+
+
+def _supports_reflink(directory: str) -> bool:
+    """
+    Checks once per filesystem whether cp --reflink works in a directory
+    """
+    dev = os.stat(directory).st_dev
+    if dev not in _reflink_support:
+        probe = os.path.join(directory, ".reflink-probe")
+        with open(probe, "w") as f:
+            f.write("probe")
+        _reflink_support[dev] = _reflink(probe, probe + ".copy")
+        for p in (probe, probe + ".copy"):
+            if os.path.exists(p):
+                os.remove(p)
+    return _reflink_support[dev]
+
+
+def _walk(root: str) -> Tuple[List[str], Dict[str, Tuple[int, int]]]:
+    """
+    The directories and files below root, relative to it
+    @return: The directories and, per file, its (size, mtime_ns)
+    """
+    dirs = []
+    files = {}
+    stack = [""]
+    while stack:
+        rel = stack.pop()
+        with os.scandir(os.path.join(root, rel)) as entries:
+            for e in entries:
+                if e.name in ALWAYS_SKIPPED:
+                    continue
+                path = e.name if rel == "" else rel + "/" + e.name
+                if e.is_dir(follow_symlinks=False):
+                    dirs.append(path)
+                    stack.append(path)
+                else:
+                    st = e.stat(follow_symlinks=False)
+                    files[path] = (st.st_size, st.st_mtime_ns)
+    return dirs, files
+
+
+class Checkpoint:
+    """
+    One saved state of a workspace
+    """
+    def __init__(self, number: int, method: str, location: str,
+                 manifest: Dict[str, Tuple[int, int]]=None):
+        """
+        @param number: The checkpoint number, counted from 1 per workspace
+        @param method: reflink, git or hardlink
+        @param location: The snapshot directory, or the tree id for git
+        @param manifest: For hardlink snapshots, the (size, mtime_ns) of each file
+        """
+        self.number = number
+        self.method = method
+        self.location = location
+        self.manifest = manifest
+
+    def discard(self):
+        """
+        Deletes the snapshot directory of the checkpoint
+        """
+        if self.method != "git":
+            shutil.rmtree(self.location, ignore_errors=True)
+
+
+class Workspace:
+    """
+    The checkpoints of one directory
+    """
+    def __init__(self, path: str):
+        """
+        @param path: The workspace directory. Symlinks are resolved so a
+                     worktree linked into the working directory works too.
+        """
+        self.path = os.path.realpath(path)
+        if not os.path.isdir(self.path):
+            raise FileNotFoundError(path)
+        self.checkpoints: List[Checkpoint] = []
+        self.git_root = _git_toplevel(self.path)
+
+    def _snapshot_dir(self, number: int) -> str:
+        """
+        A new snapshot directory on the same filesystem as the workspace
+        """
+        root = os.path.join(os.path.dirname(self.path), SNAPSHOT_DIR,
+                            os.path.basename(self.path))
+        os.makedirs(root, exist_ok=True)
+        path = os.path.join(root, str(number))
+        shutil.rmtree(path, ignore_errors=True)
+        return path
+
+    def _git_env(self) -> Dict[str, str]:
+        """
+        Points git at a private index so the real one is left alone.
+        The index is kept between checkpoints so unchanged files are not
+        hashed again.
+        """
+        git_dir = _git(["rev-parse", "--absolute-git-dir"], self.git_root)
+        return {"GIT_INDEX_FILE": os.path.join(git_dir, CHECKPOINT_INDEX)}
+
+    def checkpoint(self) -> Checkpoint:
+        """
+        Saves the current state of the workspace
+        """
+        number = len(self.checkpoints) + 1
+        if _supports_reflink(os.path.dirname(self.path)):
+            location = self._snapshot_dir(number)
+            if not _reflink(self.path, location):
+                raise RollbackError(f"Could not clone {self.path}")
+            cp = Checkpoint(number, "reflink", location)
+        elif self.git_root == self.path:
+            env = self._git_env()
+            _git(["add", "--all", "."], self.path, env)
+            tree = _git(["write-tree"], self.path, env)
+            cp = Checkpoint(number, "git", tree)
+        else:
+            location = self._snapshot_dir(number)
+            dirs, files = _walk(self.path)
+            os.makedirs(location)
+            for d in dirs:
+                os.makedirs(os.path.join(location, d), exist_ok=True)
+            for f in files:
+                os.link(os.path.join(self.path, f), os.path.join(location, f),
+                        follow_symlinks=False)
+            cp = Checkpoint(number, "hardlink", location, files)
+        self.checkpoints.append(cp)
+        return cp
+
+    def _restore_tree(self, cp: Checkpoint):
+        """
+        Makes the workspace match a snapshot directory. Only files that
+        changed since the checkpoint are copied back.
+        """
+        snap_dirs, snap_files = _walk(cp.location)
+        dirs, files = _walk(self.path)
+        if cp.method == "hardlink":
+            # Hard links share their content with the workspace, so a file
+            # written in place also changed the snapshot
+            corrupted = [f for f, stat in cp.manifest.items()
+                         if snap_files.get(f) != stat]
+            if corrupted:
+                raise RollbackError("Files were modified in place after the "
+                                    "checkpoint: " + ", ".join(corrupted[:10]))
+        for f in files:
+            if f not in snap_files:
+                os.remove(os.path.join(self.path, f))
+        for d in sorted(dirs, reverse=True): # Children before parents
+            if d not in snap_dirs:
+                shutil.rmtree(os.path.join(self.path, d), ignore_errors=True)
+        for d in sorted(snap_dirs):
+            os.makedirs(os.path.join(self.path, d), exist_ok=True)
+        for f, stat in snap_files.items():
+            dst = os.path.join(self.path, f)
+            if files.get(f) == stat and (cp.method != "hardlink" or
+                                         os.path.samefile(dst, os.path.join(cp.location, f))):
+                continue
+            if os.path.lexists(dst):
+                os.remove(dst)
+            src = os.path.join(cp.location, f)
+            if cp.method == "reflink":
+                if not _reflink(src, dst):
+                    raise RollbackError(f"Could not restore {f}")
+            else:
+                os.link(src, dst, follow_symlinks=False)
+
+    def rollback(self, number: int=None) -> Checkpoint:
+        """
+        Restores the workspace to a checkpoint. Later checkpoints are
+        discarded. Files ignored by git are left alone in git checkpoints.
+        @param number: The checkpoint to restore. Defaults to the latest
+        """
+        if len(self.checkpoints) == 0:
+            raise CheckpointNotFound("No checkpoints exist")
+        if number is None:
+            number = self.checkpoints[-1].number
+        if number < 1 or number > len(self.checkpoints):
+            raise CheckpointNotFound(f"Checkpoint {number} does not exist")
+        cp = self.checkpoints[number - 1]
+        if cp.method == "git":
+            env = self._git_env()
+            # Stage the current state, then let git update only what differs
+            _git(["add", "--all", "."], self.path, env)
+            _git(["read-tree", "--reset", "-u", cp.location], self.path, env)
+        else:
+            self._restore_tree(cp)
+        for later in self.checkpoints[number:]:
+            later.discard()
+        del self.checkpoints[number:]
+        return cp
+
+
+_workspaces: Dict[str, Workspace] = {}
+
+
+def get_workspace(path: str) -> Workspace:
+    """
+    The workspace of a directory. Created on first use.
+    """
+    key = os.path.realpath(path)
+    if key not in _workspaces:
+        _workspaces[key] = Workspace(path)
+    return _workspaces[key]
+
+
+@atexit.register
+def discard_all():
+    """
+    Deletes every snapshot directory. Runs at exit.
+    """
+    for ws in _workspaces.values():
+        for cp in ws.checkpoints:
+            cp.discard()
+    _workspaces.clear()
@@ -1,28 +1,66 @@
 import os
-import subprocess
+from .executor import execute
+from .session import get_session
+from .build_cache import build_env
+from .snapshot import get_workspace
 
 
-def run_sh(command: str) -> str:
+def run_sh(command: str, timeout: float=None) -> str:
     """
-    Runs a shell command and saves the result in cmd_out.txt.
+    Runs a shell command and saves its output in a new cmd_out_*.txt file.
     This is a dangerous command.
+    @return: A summary with the exit code, duration and the head and tail
+             of the output
     """
-    with open("cmd_out.txt", "w", encoding="utf-8") as f:
-        subprocess.run(command, stdout=f, stderr=f, text=True, shell=True) # TODO: shell=True is dangerous
-    return "cmd_out.txt"
+    result = execute(command, timeout=timeout, env=build_env())
+    return result.summary()
+
+
+def shell(command: str, timeout: float=None) -> str:
+    """
+    Runs a command in the persistent shell session.
+    This is a dangerous command.
+    @return: A summary with the exit code, duration and the head and tail
+             of the output
+    """
+    session = get_session()
+    result = session.run(command, timeout=timeout)
+    summary = result.summary()
+    if not session.alive:
+        summary += "\nThe shell was restarted. The working directory and " \
+                   "environment variables were reset."
+    return summary
+
+
+def restart_shell():
+    """
+    Replaces the persistent shell session with a fresh one
+    """
+    get_session().restart()
+
+
+def checkpoint(path: str) -> str:
+    """
+    Saves the state of a workspace directory
+    @return: A description of the checkpoint
+    """
+    cp = get_workspace(path).checkpoint()
+    return f"Created checkpoint {cp.number} of {path} ({cp.method})"
+
+
+def rollback(path: str, number: int=None) -> str:
+    """
+    Restores a workspace directory to a checkpoint
+    @return: A description of the restored checkpoint
+    """
+    cp = get_workspace(path).rollback(number)
+    return f"Rolled {path} back to checkpoint {cp.number}"
 
 
 def list_dir(path: str) -> str:
     """
     List the contents of a directory
     """
-    contents = os.listdir(path) #TODO: Dangerous: path traversal
-    dirs = next(os.walk(path))[1]
-    contents = os.listdir(path)
-    results = ""
-    for c in contents:
-        if c in dirs:
-            results += c + "(dir)\n"
-        else:
-            results += c + "\n"
-    return results
+    with os.scandir(path) as entries: #TODO: Dangerous: path traversal
+        names = [e.name + "(dir)" if e.is_dir() else e.name for e in entries]
+    return "\n".join(names) + "\n" if names else ""
@@ -0,0 +1,188 @@
+"""
+Renders the layout of a directory as an indented tree in one pass.
+Ignored files are hidden, vendored and test directories are collapsed
+into a single line and the output is kept under a token budget.
+"""
+
+from typing import List, Optional, Tuple
+import os
+import re
+from ..ignore import GitIgnore, GITIGNORE, ALWAYS_IGNORED
+from ..tokens import count_tokens
+from .snapshot import SNAPSHOT_DIR
+
+
+MAX_DEPTH = 3
+MAX_TREE_TOKENS = 2000
+MAX_ENTRIES_PER_DIR = 40 # Larger directories only list their first entries
+COUNT_LIMIT = 100000 # Files counted below a collapsed directory
+INDENT = "  "
+MODEL_NAME = "gpt-4"
+NUMBER_RE = re.compile(r"(\d+)")
+
+VENDOR_DIRS = {"node_modules", "vendor", "third_party", "third-party",
+               "bower_components", "Pods", ".venv", "venv", "__pycache__",
+               ".tox", ".gradle", ".idea", ".vscode"}
+TEST_DIRS = {"test", "tests", "testdata", "testing", "__tests__", "spec",
+             "specs", "e2e", "fixtures", "__snapshots__"}
+TEST_FILE_RE = re.compile(r"(^test_.*\.py$|_test\.(py|go)$|\.(test|spec)\.[jt]sx?$|"
+                          r"Test\.(java|kt)$|_spec\.rb$)")
+
+
+class _Node:
+    """
+    A file or directory of the tree
+    """
+    def __init__(self, name: str, is_dir: bool, size: int=0):
+        self.name = name
+        self.is_dir = is_dir
+        self.size = size # Total size of the files below a directory
+        self.nfiles = 0 if is_dir else 1
+        self.children: List["_Node"] = []
+        self.collapsed: Optional[str] = None # Why a directory is not expanded
+
+
+def _format_size(n: int) -> str:
+    """
+    A compact human readable size
+    """
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+
+def _count(path: str) -> Tuple[int, int]:
+    """
+    Counts the files and bytes below a directory without applying
+    ignore rules. Stops after COUNT_LIMIT files.
+    @return: The number of files and their total size
+    """
+    nfiles = size = 0
+    stack = [path]
+    while stack and nfiles < COUNT_LIMIT:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for e in entries:
+            if e.is_dir(follow_symlinks=False):
+                stack.append(e.path)
+            elif e.is_file(follow_symlinks=False):
+                nfiles += 1
+                size += e.stat(follow_symlinks=False).st_size
+    return nfiles, size
+
+
+def _scan(root: str, rel: str, node: _Node, ignore: GitIgnore,
+          include_vendor: bool, include_tests: bool):
+    """
+    Fills in the children of a directory node with a single scandir per
+    directory. Vendored and test directories are only counted.
+    """
+    directory = os.path.join(root, rel)
+    ignore.add_file(os.path.join(directory, GITIGNORE), rel)
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return
+    for e in entries:
+        if e.name in ALWAYS_IGNORED or e.name == SNAPSHOT_DIR:
+            continue
+        path = e.name if rel == "" else rel + "/" + e.name
+        is_dir = e.is_dir(follow_symlinks=False)
+        if ignore.is_ignored(path, is_dir):
+            continue
+        if is_dir:
+            child = _Node(e.name, True)
+            if not include_vendor and e.name in VENDOR_DIRS:
+                child.collapsed = "vendored"
+            elif not include_tests and e.name in TEST_DIRS:
+                child.collapsed = "tests"
+            if child.collapsed is not None:
+                child.nfiles, child.size = _count(e.path)
+            else:
+                _scan(root, path, child, ignore, include_vendor, include_tests)
+        elif e.is_file(follow_symlinks=False):
+            if not include_tests and TEST_FILE_RE.search(e.name):
+                continue
+            child = _Node(e.name, False, e.stat(follow_symlinks=False).st_size)
+        else:
+            continue
+        node.children.append(child)
+        node.nfiles += child.nfiles
+        node.size += child.size
+    # Directories first, then files, each in natural order (f2 before f10)
+    node.children.sort(key=lambda c: (not c.is_dir, [int(p) if p.isdigit() else p
+                                                     for p in NUMBER_RE.split(c.name)]))
+
+
+def _dir_summary(node: _Node, sizes: bool) -> str:
+    """
+    The file count (and size) shown next to a directory
+    """
+    count = f"{node.nfiles}+" if node.nfiles >= COUNT_LIMIT else str(node.nfiles)
+    summary = f"{count} files"
+    if sizes:
+        summary += f", {_format_size(node.size)}"
+    return summary
+
+
+def _render(node: _Node, depth: int, max_depth: int, sizes: bool,
+            lines: List[str]):
+    """
+    Appends the lines of the children of a directory node
+    """
+    indent = INDENT * depth
+    shown = node.children[:MAX_ENTRIES_PER_DIR]
+    for child in shown:
+        if not child.is_dir:
+            lines.append(f"{indent}{child.name}" +
+                         (f" ({_format_size(child.size)})" if sizes else ""))
+        elif child.collapsed is not None:
+            lines.append(f"{indent}{child.name}/ [{child.collapsed}, "
+                         f"{_dir_summary(child, sizes)}]")
+        elif depth + 1 >= max_depth and len(child.children) > 0:
+            lines.append(f"{indent}{child.name}/ ({_dir_summary(child, sizes)})")
+        else:
+            lines.append(f"{indent}{child.name}/")
+            _render(child, depth + 1, max_depth, sizes, lines)
+    hidden = node.children[MAX_ENTRIES_PER_DIR:]
+    if hidden:
+        nfiles = sum(c.nfiles for c in hidden)
+        lines.append(f"{indent}... {len(hidden)} more entries ({nfiles} files)")
+
+
+def tree(path: str, max_depth: int=MAX_DEPTH, include_vendor: bool=False,
+         include_tests: bool=False, sizes: bool=True,
+         max_tokens: int=MAX_TREE_TOKENS) -> str:
+    """
+    Renders the layout of a directory. .gitignore rules are applied.
+    If the tree does not fit in max_tokens, the depth is reduced until
+    it does and the deepest directories are shown as file counts.
+    """
+    if not os.path.isdir(path):
+        raise FileNotFoundError(path)
+    ignore = GitIgnore()
+    ignore.add_file(os.path.join(path, ".git", "info", "exclude"))
+    root = _Node(os.path.basename(os.path.abspath(path)), True)
+    _scan(path, "", root, ignore, include_vendor, include_tests)
+
+    header = f"{path.rstrip('/')}/ ({_dir_summary(root, sizes)})"
+    for depth in range(max(max_depth, 1), 0, -1):
+        lines = [header]
+        _render(root, 0, depth, sizes, lines)
+        text = "\n".join(lines)
+        if count_tokens(text, MODEL_NAME) <= max_tokens:
+            return text
+    # Even the top level is too big, so cut it off
+    kept = []
+    ntokens = 0
+    for line in lines:
+        ntokens += count_tokens(line + "\n", MODEL_NAME)
+        if ntokens > max_tokens:
+            kept.append(f"... output truncated at {max_tokens} tokens")
+            break
+        kept.append(line)
+    return "\n".join(kept)
@@ -0,0 +1,106 @@
+"""
+Token accounting shared by the toolkits. Encoders are created once per
+model and a per-run ledger keeps cumulative token counts by tool and
+by model.
+"""
+
+from typing import Dict, List
+import functools
+import threading
+import tiktoken
+
+
+DEFAULT_MODEL = "gpt-4"
+APPROX_CHARS_PER_TOKEN = 4
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model_name: str) -> tiktoken.Encoding:
+    """
+    The tokenizer of a model. Loading an encoding is expensive so
+    each one is only created once.
+    """
+    return tiktoken.encoding_for_model(model_name)
+
+
+def count_tokens(content: str, model_name: str=DEFAULT_MODEL) -> int:
+    """
+    The exact number of tokens in a text
+    """
+    return len(get_encoding(model_name).encode(content, disallowed_special=()))
+
+
+def count_tokens_batch(contents: List[str], model_name: str=DEFAULT_MODEL) -> List[int]:
+    """
+    The exact number of tokens in each of several texts. Texts are
+    encoded in parallel by tiktoken.
+    """
+    encoded = get_encoding(model_name).encode_batch(contents, disallowed_special=())
+    return [len(e) for e in encoded]
+
+
+def truncate_tokens(content: str, max_tokens: int, model_name: str=DEFAULT_MODEL) -> str:
+    """
+    The longest prefix of a text that fits in max_tokens
+    """
+    encoding = get_encoding(model_name)
+    tokens = encoding.encode(content, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return content
+    return encoding.decode(tokens[:max_tokens])
+
+
+def approx_tokens(content: str) -> int:
+    """
+    A fast estimate of the number of tokens in a text for logging
+    and bookkeeping where exact counts are not needed
+    """
+    return (len(content) + APPROX_CHARS_PER_TOKEN - 1) // APPROX_CHARS_PER_TOKEN
+
+
+class TokenLedger:
+    """
+    Cumulative token counts of a run by tool and by model
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_tool = {}
+        self._by_model = {}
+
+    def record(self, tool: str, model_name: str, ntokens: int):
+        """
+        Adds ntokens to the counters of a tool and a model
+        """
+        with self._lock:
+            self._by_tool[tool] = self._by_tool.get(tool, 0) + ntokens
+            self._by_model[model_name] = self._by_model.get(model_name, 0) + ntokens
+
+    def by_tool(self) -> Dict[str, int]:
+        """
+        Tokens recorded per tool
+        """
+        with self._lock:
+            return dict(self._by_tool)
+
+    def by_model(self) -> Dict[str, int]:
+        """
+        Tokens recorded per model
+        """
+        with self._lock:
+            return dict(self._by_model)
+
+    def summary(self) -> str:
+        """
+        A printable table of the counters
+        """
+        lines = ["Tokens by tool:"]
+        for tool, n in sorted(self.by_tool().items(), key=lambda x: -x[1]):
+            lines.append(f"\t{tool}: {n}")
+        lines.append("Tokens by model:")
+        for model_name, n in sorted(self.by_model().items(), key=lambda x: -x[1]):
+            lines.append(f"\t{model_name}: {n}")
+        return "\n".join(lines)
+
+
+# The counters of the current run
+ledger = TokenLedger()
@@ -1,4 +1,4 @@
-import tiktoken
+from .tokens import count_tokens
 
 
 def get_openai_model_name() -> str:
@@ -8,7 +8,4 @@ def get_openai_model_temperature() -> int:
     return 0
 
 def ntokens(content: str) -> int:
-    model = get_openai_model_name()
-    enc = tiktoken.encoding_for_model(model)
-    e = enc.encode(content)
-    return len(e)
\ No newline at end of file
+    return count_tokens(content, get_openai_model_name())
\ No newline at end of file
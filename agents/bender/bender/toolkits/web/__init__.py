@@ -5,6 +5,7 @@ A collection of tools for search the web
 from typing import List
 import logging
 from .tools import websearch
+from .fetch import fetch as fetch_pages
 
 
 MAX_DISPLAY_RESULTS = 3
@@ -22,4 +23,24 @@ def web_websearch(query: str) -> List[str]:
     else:
         summary = "\n\t".join(results[:MAX_DISPLAY_RESULTS])
     logging.info(summary)
-    return results
\ No newline at end of file
+    return results
+
+
+def web_fetch(urls: List[str]) -> str:
+    """
+    Downloads one or more web pages and returns their readable text, e.g.
+    a project's install or build docs. Several urls are fetched at once,
+    so pass every page you need in a single call. Long pages are shortened.
+    Errors are reported per url.
+    """
+    logging.info(f"Fetching {', '.join(urls)}...")
+    blocks = []
+    for page in fetch_pages(urls):
+        if page.error is not None:
+            logging.error(f"Could not fetch {page.url}: {page.error}")
+            blocks.append(f"[{page.url}]\nError: {page.error}")
+        else:
+            blocks.append(f"[{page.url}]\n{page.text}")
+    text = "\n\n".join(blocks)
+    logging.info(f"Fetched {len(urls)} pages, {len(text)} characters")
+    return text
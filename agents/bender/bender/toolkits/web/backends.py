@@ -0,0 +1,140 @@
+"""
+Pluggable web search backends. Results are cached on disk per normalized
+query and identical queries that run at the same time share one lookup.
+"""
+
+from typing import Dict, List
+import os
+import json
+import functools
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from ..cache import DiskCache, cache_dir, make_key
+
+
+BACKEND_ENV = "BENDER_SEARCH_BACKEND"
+FIXTURES_ENV = "BENDER_SEARCH_FIXTURES"
+CACHE_TTL_ENV = "BENDER_SEARCH_CACHE_TTL"
+DEFAULT_BACKEND = "google"
+DEFAULT_CACHE_TTL = 7 * 24 * 60 * 60 # Seconds
+
+
+def normalize_query(query: str) -> str:
+    """
+    Queries that only differ in case or whitespace are the same query
+    """
+    return " ".join(query.lower().split())
+
+
+class SearchBackend(ABC):
+    """
+    The interface of a search backend
+    """
+    name = "base"
+
+    @abstractmethod
+    def search(self, query: str, num_results: int) -> List[str]:
+        """
+        Returns the top urls for a query
+        """
+        raise NotImplementedError()
+
+
+class GoogleBackend(SearchBackend):
+    """
+    Live Google search through googlesearch-python
+    """
+    name = "google"
+
+    def search(self, query: str, num_results: int) -> List[str]:
+        from googlesearch import search
+        return list(search(query, num_results=num_results))
+
+
+class FixtureBackend(SearchBackend):
+    """
+    Answers queries from a JSON file that maps queries to lists of urls.
+    For tests and runs without network access.
+    """
+    name = "fixture"
+
+    def __init__(self, path: str):
+        """
+        @param path: The JSON fixture file
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.results: Dict[str, List[str]] = {normalize_query(q): urls
+                                              for q, urls in data.items()}
+
+    def search(self, query: str, num_results: int) -> List[str]:
+        return self.results.get(normalize_query(query), [])[:num_results]
+
+
+class CachedBackend(SearchBackend):
+    """
+    Wraps a backend with a TTL cache on disk. Concurrent calls with the
+    same query wait for the first one instead of searching again.
+    Empty results are not cached since they usually mean throttling.
+    """
+    def __init__(self, backend: SearchBackend, cache: DiskCache,
+                 ttl: float=DEFAULT_CACHE_TTL):
+        """
+        @param backend: The backend to cache
+        @param cache: Where results are stored
+        @param ttl: Seconds before a cached result is searched again
+        """
+        self.backend = backend
+        self.cache = cache
+        self.ttl = ttl
+        self.name = "cached-" + backend.name
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+
+    def search(self, query: str, num_results: int) -> List[str]:
+        key = make_key("search", self.backend.name, normalize_query(query), num_results)
+        cached = self.cache.get(key, ttl=self.ttl)
+        if cached is not None:
+            return json.loads(cached)
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+        if not owner:
+            return list(future.result())
+
+        try:
+            results = self.backend.search(query, num_results)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(results)
+            if len(results) > 0:
+                self.cache.put(key, json.dumps(results))
+            return results
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+
+@functools.lru_cache(maxsize=None)
+def get_backend() -> SearchBackend:
+    """
+    The search backend selected by the BENDER_SEARCH_BACKEND env var
+    (google or fixture) wrapped in the on-disk cache
+    """
+    name = os.environ.get(BACKEND_ENV, DEFAULT_BACKEND)
+    if name == "google":
+        backend = GoogleBackend()
+    elif name == "fixture":
+        backend = FixtureBackend(os.environ[FIXTURES_ENV])
+    else:
+        raise ValueError(f"Unknown search backend {name}")
+    ttl = float(os.environ.get(CACHE_TTL_ENV, DEFAULT_CACHE_TTL))
+    cache = DiskCache(os.path.join(cache_dir("web"), "search.db"))
+    return CachedBackend(backend, cache, ttl)
@@ -0,0 +1,177 @@
+"""
+Fetches web pages concurrently over a pooled HTTP client and extracts
+their text. Pages are cached on disk and revalidated with ETag and
+Last-Modified so unchanged pages are not downloaded again.
+"""
+
+from typing import List, Optional
+import os
+import json
+import time
+import asyncio
+import functools
+import threading
+import httpx
+from bs4 import BeautifulSoup
+from ..cache import DiskCache, cache_dir, make_key
+from ..tokens import count_tokens, truncate_tokens
+
+
+MAX_FETCH_TOKENS = 3000 # Shared by all pages of one call
+MAX_CONCURRENCY = 8
+MAX_BYTES = 2 * 1024 * 1024 # Larger pages are cut off
+TIMEOUT = 15 # Seconds
+POOL_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+USER_AGENT = "bender/1.0"
+TEXT_TYPES = ("text/", "application/json", "application/xml",
+              "application/xhtml+xml", "application/x-yaml")
+STRIPPED_TAGS = ["script", "style", "noscript", "svg", "nav", "footer",
+                 "header", "form", "iframe"]
+
+
+class Page:
+    """
+    The extracted text of a fetched url
+    """
+    def __init__(self, url: str, status: int, text: str="", error: str=None,
+                 cached: bool=False):
+        """
+        @param url: The requested url
+        @param status: The HTTP status, 0 if the request failed
+        @param text: The extracted text
+        @param error: Why the page could not be fetched
+        @param cached: True if the text came from the cache
+        """
+        self.url = url
+        self.status = status
+        self.text = text
+        self.error = error
+        self.cached = cached
+
+
+def extract_text(body: str, content_type: str) -> str:
+    """
+    The readable text of a response. Markup, scripts and navigation
+    are removed from HTML. Other text types are returned as is.
+    """
+    if "html" not in content_type:
+        return body.strip()
+    soup = BeautifulSoup(body, "html.parser")
+    for tag in soup(STRIPPED_TAGS):
+        tag.decompose()
+    root = soup.find("main") or soup.find("article") or soup.body or soup
+    lines = (line.strip() for line in root.get_text("\n").splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+class Fetcher:
+    """
+    An HTTP client that lives on its own event loop thread so that its
+    connection pool is reused across tool calls
+    """
+    def __init__(self, cache: DiskCache):
+        """
+        @param cache: Where pages and their validators are stored
+        """
+        self.cache = cache
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        self.client: Optional[httpx.AsyncClient] = None
+
+    async def _client(self) -> httpx.AsyncClient:
+        """
+        The pooled client. Created on the fetcher's loop on first use.
+        """
+        if self.client is None:
+            self.client = httpx.AsyncClient(limits=POOL_LIMITS, timeout=TIMEOUT,
+                                            follow_redirects=True,
+                                            headers={"User-Agent": USER_AGENT})
+        return self.client
+
+    async def _fetch(self, url: str, limiter: asyncio.Semaphore) -> Page:
+        """
+        Fetches one url, revalidating a cached copy if there is one
+        """
+        key = make_key("fetch", url)
+        cached = self.cache.get(key)
+        entry = json.loads(cached) if cached is not None else None
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        client = await self._client()
+        async with limiter:
+            try:
+                async with client.stream("GET", url, headers=headers) as r:
+                    if r.status_code == 304 and entry is not None:
+                        return Page(url, 200, entry["text"], cached=True)
+                    if r.status_code >= 400:
+                        return Page(url, r.status_code, error=f"HTTP {r.status_code}")
+                    content_type = r.headers.get("content-type", "").lower()
+                    if not content_type.startswith(TEXT_TYPES):
+                        return Page(url, r.status_code,
+                                    error=f"Unsupported content type {content_type}")
+                    body = bytearray()
+                    truncated = False
+                    async for chunk in r.aiter_bytes():
+                        body += chunk
+                        if len(body) >= MAX_BYTES:
+                            truncated = True
+                            break
+                    encoding = r.encoding or "utf-8"
+            except (httpx.HTTPError, httpx.InvalidURL) as e:
+                return Page(url, 0, error=f"{type(e).__name__}: {e}")
+        text = extract_text(body[:MAX_BYTES].decode(encoding, errors="replace"),
+                            content_type)
+        if truncated:
+            text += f"\n... [page cut off after {MAX_BYTES // 1024} KiB]"
+        etag = r.headers.get("etag")
+        last_modified = r.headers.get("last-modified")
+        # A cut off page is not a copy of the resource, so it is not revalidated
+        if (etag or last_modified) and not truncated:
+            self.cache.put(key, json.dumps({"etag": etag, "last_modified": last_modified,
+                                            "text": text, "fetched": time.time()}))
+        return Page(url, r.status_code, text)
+
+    async def _fetch_all(self, urls: List[str]) -> List[Page]:
+        """
+        Fetches urls concurrently, at most MAX_CONCURRENCY at a time
+        """
+        limiter = asyncio.Semaphore(MAX_CONCURRENCY)
+        return await asyncio.gather(*[self._fetch(u, limiter) for u in urls])
+
+    def fetch(self, urls: List[str]) -> List[Page]:
+        """
+        Fetches several urls concurrently
+        """
+        future = asyncio.run_coroutine_threadsafe(self._fetch_all(urls), self.loop)
+        return future.result()
+
+
+@functools.lru_cache(maxsize=None)
+def get_fetcher() -> Fetcher:
+    """
+    The fetcher shared by all calls
+    """
+    return Fetcher(DiskCache(os.path.join(cache_dir("web"), "pages.db")))
+
+
+def fetch(urls: List[str], max_tokens: int=MAX_FETCH_TOKENS) -> List[Page]:
+    """
+    Fetches pages and cuts their text down so that all of them together
+    fit in max_tokens. Short pages leave their unused share to longer ones.
+    """
+    urls = list(dict.fromkeys(urls)) # Drop duplicates, keep the order
+    pages = get_fetcher().fetch(urls)
+    sizes = [count_tokens(p.text) for p in pages]
+    remaining = max_tokens
+    for n, i in enumerate(sorted(range(len(pages)), key=lambda i: sizes[i])):
+        share = remaining // (len(pages) - n)
+        if sizes[i] > share:
+            pages[i].text = truncate_tokens(pages[i].text, share) + "\n... [truncated]"
+            sizes[i] = share
+        remaining -= sizes[i]
+    return pages
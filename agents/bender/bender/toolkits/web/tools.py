@@ -1,5 +1,5 @@
 from typing import List
-from googlesearch import search
+from .backends import get_backend
 
 
 MAX_SEARCH_RESULTS = 10
@@ -7,6 +7,7 @@ MAX_SEARCH_RESULTS = 10
 
 def websearch(query: str) -> List[str]:
     """
-    Returns a list of top urls from a google search
+    Returns a list of top urls from a web search. Results are cached
+    so repeated queries are answered without searching again.
     """
-    return list(search(query, num_results=MAX_SEARCH_RESULTS))
\ No newline at end of file
+    return get_backend().search(query, MAX_SEARCH_RESULTS)
\ No newline at end of file
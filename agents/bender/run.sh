@@ -8,5 +8,7 @@
 
 BASEDIR=$(dirname $BASH_SOURCE)
 SRC=$(pwd)/$BASEDIR/bender
+CACHE=${BENDER_CACHE_DIR:-$HOME/.cache/bender} # Repository mirrors persist across runs
+mkdir -p $CACHE
 
-docker run -it --rm -v $4:/output -v $SRC:/work/bender bender-agent python bender/main.py $1 -v $2 -o $3
\ No newline at end of file
+docker run -it --rm -v $4:/output -v $SRC:/work/bender -v $CACHE:/cache -e BENDER_CACHE_DIR=/cache bender-agent python bender/main.py $1 -v $2 -o $3
\ No newline at end of file
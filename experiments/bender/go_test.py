@@ -11,6 +11,7 @@ PROJECT_TOPLVL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".
 BENDER_BIN_PATH = os.path.join(PROJECT_TOPLVL_DIR, "agents/bender/bender/main.py")
 WORK_DIR = "tmp"
 SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../agents/bender/bender")
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bender") # Shared by all runs
 
 
 class UserCancelError(Exception):
@@ -29,7 +30,8 @@ def parse_args():
 
 
 def run_bender(package: str, version: str, outpath: str, out_filename: str):
-    cmd = f"docker run -it --rm -v {outpath}:/output -v {SRC_DIR}:/work/bender bender-agent python bender/main.py {package} -v {version} -o {out_filename}"
+    # Runs share repository mirrors and check out pooled worktrees
+    cmd = f"docker run -it --rm -v {outpath}:/output -v {SRC_DIR}:/work/bender -v {CACHE_DIR}:/cache -e BENDER_CACHE_DIR=/cache -e BENDER_CLONE_MODE=worktree bender-agent python bender/main.py {package} -v {version} -o {out_filename}"
     subprocess.run(cmd, shell=True)
 
 
@@ -53,6 +55,7 @@ def get_version(yaml_path: str) -> str:
 
 def main():
     args = parse_args()
+    os.makedirs(CACHE_DIR, exist_ok=True)
 
     if not os.path.exists(args.samples):
         print("Error: Samples directory was not found")
@@ -0,0 +1,111 @@
+import os
+import json
+import argparse
+
+
+N_COMMANDS_DEFAULT = 20
+LEDGER_SUFFIX = ".resources.jsonl"
+MAX_COMMAND_LEN = 80
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Ranks the slowest commands run by bender across an experiment")
+    parser.add_argument("results",
+                        help="The output directory of an experiment")
+    parser.add_argument("-n", default=N_COMMANDS_DEFAULT,
+                        help="The number of commands to show")
+    parser.add_argument("--tool",
+                        help="Only show commands run by this tool, e.g. run_sh or git")
+    return parser.parse_args()
+
+
+def load_records(results: str) -> list:
+    """
+    Loads every resource ledger below the results directory. Each record
+    is tagged with the package and the run it came from.
+    """
+    records = []
+    for dirpath, _, filenames in os.walk(results):
+        for filename in filenames:
+            if not filename.endswith(LEDGER_SUFFIX):
+                continue
+            run = filename[:-len(LEDGER_SUFFIX)]
+            package = os.path.relpath(dirpath, results)
+            with open(os.path.join(dirpath, filename), "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if len(line) == 0:
+                        continue
+                    try:
+                        r = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue # A run that was killed mid-write
+                    r["package"] = package
+                    r["run"] = run
+                    records.append(r)
+    return records
+
+
+def shorten(command: str) -> str:
+    command = " ".join(command.split())
+    if len(command) <= MAX_COMMAND_LEN:
+        return command
+    return command[:MAX_COMMAND_LEN - 3] + "..."
+
+
+def format_rss(kb) -> str:
+    if kb is None:
+        return "-"
+    return f"{kb / 1024:.0f}M"
+
+
+def print_slowest(records: list, n: int):
+    print(f"{'wall':>8} {'user':>8} {'sys':>7} {'rss':>6} {'rss hwm':>7} {'exit':>5}  "
+          f"{'package/run':<24} {'tool':<7} command")
+    shared = False
+    for r in sorted(records, key=lambda r: -r["wall"])[:n]:
+        exit_code = "T/O" if r.get("timed_out") else str(r.get("exit_code"))
+        where = f"{r['package']}/{r['run']}"
+        rss, hwm = r.get("max_rss_kb"), r.get("children_max_rss_kb")
+        if "isolated" not in r:
+            rss, hwm = None, rss # Older ledgers only had the high-water mark
+        mark = " " if r.get("isolated") else "*"
+        shared = shared or mark == "*"
+        print(f"{r['wall']:>7.1f}s {r['user']:>7.1f}s{mark}{r['sys']:>6.1f}s "
+              f"{format_rss(rss):>6} {format_rss(hwm):>7} {exit_code:>5}  "
+              f"{where:<24} {r['tool']:<7} {shorten(r['command'])}")
+    print("\nrss: peak RSS of the command, - if it was not measured on its own. "
+          "Never below the size of the agent that forked it")
+    print("rss hwm: high-water mark so far of the peak RSS of every command "
+          "in the run, not of this command")
+    if shared:
+        print("*: CPU time may include other commands that exited at the same time")
+
+
+def print_totals(records: list):
+    totals = {}
+    for r in records:
+        t = totals.setdefault(r["tool"], [0, 0.0, 0.0])
+        t[0] += 1
+        t[1] += r["wall"]
+        t[2] += r["user"] + r["sys"]
+    print("\nTotals by tool:")
+    for tool, (count, wall, cpu) in sorted(totals.items(), key=lambda x: -x[1][1]):
+        print(f"\t{tool}: {count} commands, {wall:.1f}s wall, {cpu:.1f}s cpu")
+
+
+def main():
+    args = parse_args()
+    records = load_records(args.results)
+    if args.tool:
+        records = [r for r in records if r["tool"] == args.tool]
+    if len(records) == 0:
+        print("Error: No resource ledgers found")
+        return
+    print_slowest(records, int(args.n))
+    print_totals(records)
+
+
+if __name__ == "__main__":
+    main()